@@ -9,83 +9,436 @@ Original file is located at
 
 import heapq
 import math
+import time
+import tracemalloc
+from array import array
+from functools import lru_cache
 
+import numpy as np
 
-def edge_cost(graph, u, v):
-    for nei, w in graph.get(u, []):
-        if nei == v:
-            return w
-    return math.inf
 
+# masks of unvisited nodes whose MST cost tsp_astar remembers
+MST_CACHE_SIZE = 1 << 16
 
-def prim_mst(graph, nodes):
-    if not nodes:
+
+def compile_graph(graph):
+    # the graph as a dense cost matrix, inf where there is no edge, and
+    # the neighbors of every node sorted by edge cost
+    n = len(graph)
+    costs = np.full((n, n), np.inf)
+    for u, edges in graph.items():
+        for v, w in edges:
+            costs[u, v] = min(costs[u, v], w)
+    # no self loops: a node is never its own nearest unvisited neighbor
+    np.fill_diagonal(costs, np.inf)
+    neighbors = []
+    for u in range(n):
+        order = np.argsort(costs[u], kind="stable")
+        neighbors.append(order[np.isfinite(costs[u, order])])
+    return costs, neighbors
+
+
+def prim_mst(matrix, nodes):
+    # matrix: the costs as lists, single entries read faster from lists
+    # than from a NumPy array
+    if len(nodes) == 0:
         return 0
 
     nodes = list(nodes)
-    in_tree = {nodes[0]}
+    in_tree = set()
     total_cost = 0
+    heap = [(0, nodes[0])]
 
-    while len(in_tree) < len(nodes):
-        best_edge = math.inf
-        next_node = None
-        for u in in_tree:
-            for v, w in graph.get(u, []):
-                if v in nodes and v not in in_tree and w < best_edge:
-                    best_edge, next_node = w, v
-        if next_node is None:
-            return math.inf
-        total_cost += best_edge
-        in_tree.add(next_node)
+    while heap and len(in_tree) < len(nodes):
+        w, u = heapq.heappop(heap)
+        if u in in_tree:
+            continue
+        in_tree.add(u)
+        total_cost += w
+        row = matrix[u]
+        for v in nodes:
+            if v not in in_tree and row[v] < math.inf:
+                heapq.heappush(heap, (row[v], v))
 
+    if len(in_tree) < len(nodes):
+        return math.inf
     return total_cost
 
 
-def heuristic(curr, unvisited, graph, start):
-    if not unvisited:
-        return edge_cost(graph, curr, start)
+def heuristic(curr, unvisited, costs, start, mst_cost=None):
+    # unvisited: node ids (array or list); mst_cost: the MST of unvisited, if
+    # the caller already knows it
+    if len(unvisited) == 0:
+        return float(costs[curr, start])
 
-    from_curr = min(edge_cost(graph, curr, v) for v in unvisited)
+    from_curr = costs[curr, unvisited].min()
 
-    mst_cost = prim_mst(graph, unvisited)
+    if mst_cost is None:
+        mst_cost = prim_mst(costs.tolist(), unvisited)
 
-    to_start = min(edge_cost(graph, v, start) for v in unvisited)
+    to_start = costs[unvisited, start].min()
 
-    return from_curr + mst_cost + to_start
+    return float(from_curr + mst_cost + to_start)
 
 
 def tsp_astar(graph, start=0):
     n = len(graph)
     all_visited_mask = (1 << n) - 1
+    costs, neighbors = compile_graph(graph)
+    rows = costs.tolist()
+    node_ids = np.arange(n)
+
+    # the MST of the unvisited nodes and their cheapest edge back to start
+    # don't depend on the current node, successors with the same visited
+    # set share them
+    @lru_cache(maxsize=MST_CACHE_SIZE)
+    def rest_bound(unvisited_mask):
+        nodes = [i for i in range(n) if unvisited_mask >> i & 1]
+        return prim_mst(rows, nodes) + float(costs[nodes, start].min())
 
-    initial_unvisited = {i for i in range(n) if i != start}
-    pq = [(heuristic(start, initial_unvisited, graph, start), 0, start, 1 << start, [start])]
-    best_state = {}
+    # Every pushed state is a record in these arrays, the heap only holds
+    # (f, record id); the path is rebuilt from the parent ids at the goal
+    record_node = array("H", [start])
+    record_mask = array("Q", [1 << start])
+    record_g = array("d", [0.0])
+    record_parent = array("l", [-1])
+    # cheapest g pushed so far per state (mask << 8 | node): a state is not
+    # pushed again unless it got cheaper, so the heap holds no duplicates
+    best_g = {(1 << start) << 8 | start: 0.0}
+
+    initial_unvisited = node_ids[node_ids != start]
+    pq = [(heuristic(start, initial_unvisited, costs, start), 0)]
 
     while pq:
-        f, g, node, visited_mask, path = heapq.heappop(pq)
+        f, record = heapq.heappop(pq)
+        node = record_node[record]
+        visited_mask = record_mask[record]
+        g = record_g[record]
 
         if visited_mask == all_visited_mask:
-            return g + edge_cost(graph, node, start), path + [start]
+            path = [start]
+            while record != -1:
+                path.append(record_node[record])
+                record = record_parent[record]
+            return g + rows[node][start], path[::-1]
 
-        if (node, visited_mask) in best_state and best_state[(node, visited_mask)] <= g:
+        # a cheaper way to this state was pushed after this one
+        if best_g[visited_mask << 8 | node] < g:
             continue
-        best_state[(node, visited_mask)] = g
 
-        for nxt, w in graph.get(node, []):
-            if visited_mask & (1 << nxt):
-                continue
+        successors = neighbors[node]
+        successors = successors[(visited_mask >> successors) & 1 == 0]
+        if len(successors) == 0:
+            continue
+        unvisited = node_ids[(visited_mask >> node_ids) & 1 == 0]
+        if len(unvisited) == 1:
+            # the last node, then straight back to start
+            from_next = costs[successors, start]
+        else:
+            # cheapest edge from each successor into the rest, all at once
+            # (the inf diagonal leaves the successor itself out)
+            from_next = costs[np.ix_(successors, unvisited)].min(axis=1)
+
+        for nxt, w, h in zip(successors.tolist(), costs[node, successors].tolist(), from_next.tolist()):
             new_mask = visited_mask | (1 << nxt)
             new_g = g + w
-            unvisited = {i for i in range(n) if not (new_mask & (1 << i))}
-            h = heuristic(nxt, unvisited, graph, start)
+            state = new_mask << 8 | nxt
+            if best_g.get(state, math.inf) <= new_g:
+                continue
+            if new_mask != all_visited_mask:
+                h += rest_bound(all_visited_mask & ~new_mask)
             if h == math.inf:
                 continue
-            heapq.heappush(pq, (new_g + h, new_g, nxt, new_mask, path + [nxt]))
+            best_g[state] = new_g
+            heapq.heappush(pq, (new_g + h, len(record_node)))
+            record_node.append(nxt)
+            record_mask.append(new_mask)
+            record_g.append(new_g)
+            record_parent.append(record)
 
     return math.inf, []
 
 
+# ---------- anytime: local search incumbent + branch and bound ----------
+
+
+def tour_cost(rows, tour):
+    return sum(rows[a][b] for a, b in zip(tour, tour[1:]))
+
+
+def nearest_neighbour_tour(rows, neighbors, start):
+    # greedy tour from every node, rotated to begin at start; the cheapest,
+    # None if every one of them runs into a dead end (sparse graphs)
+    n = len(rows)
+    best_cost, best_tour = math.inf, None
+    for first in range(n):
+        tour = [first]
+        visited = {first}
+        node = first
+        while len(tour) < n:
+            for nxt in neighbors[node].tolist():
+                if nxt not in visited:
+                    break
+            else:
+                break
+            tour.append(nxt)
+            visited.add(nxt)
+            node = nxt
+        if len(tour) < n or rows[node][first] == math.inf:
+            continue
+        at = tour.index(start)
+        tour = tour[at:] + tour[:at] + [start]
+        cost = tour_cost(rows, tour)
+        if cost < best_cost:
+            best_cost, best_tour = cost, tour
+    return best_tour
+
+
+# smallest change local search counts as an improvement, so rounding
+# can't make it go back and forth
+IMPROVEMENT = 1e-9
+
+
+def two_opt(rows, tour):
+    # reverse tour[i..j] where that shortens the tour; only for symmetric
+    # costs, a reversed segment is walked the other way
+    improved = False
+    for i in range(1, len(tour) - 2):
+        for j in range(i + 1, len(tour) - 1):
+            a, b, c, d = tour[i - 1], tour[i], tour[j], tour[j + 1]
+            if rows[a][c] + rows[b][d] < rows[a][b] + rows[c][d] - IMPROVEMENT:
+                tour[i:j + 1] = tour[i:j + 1][::-1]
+                improved = True
+    return improved
+
+
+def or_opt(rows, tour):
+    # move a run of 1-3 nodes to the best other place in the tour, same
+    # direction; the start stays at both ends
+    improved = False
+    for length in (1, 2, 3):
+        i = 1
+        while i + length < len(tour):
+            segment = tour[i:i + length]
+            prev, nxt = tour[i - 1], tour[i + length]
+            saved = rows[prev][segment[0]] + rows[segment[-1]][nxt] - rows[prev][nxt]
+            rest = tour[:i] + tour[i + length:]
+            best_delta, best_k = -IMPROVEMENT, None
+            for k in range(len(rest) - 1):
+                a, b = rest[k], rest[k + 1]
+                delta = rows[a][segment[0]] + rows[segment[-1]][b] - rows[a][b] - saved
+                if delta < best_delta:
+                    best_delta, best_k = delta, k
+            if best_k is None:
+                i += 1
+                continue
+            tour[:] = rest[:best_k + 1] + segment + rest[best_k + 1:]
+            improved = True
+    return improved
+
+
+def improve_tour(rows, tour, symmetric, deadline=math.inf):
+    # 2-opt (symmetric costs) and Or-opt until neither helps
+    while time.perf_counter() < deadline:
+        improved = two_opt(rows, tour) if symmetric else False
+        if not or_opt(rows, tour) and not improved:
+            break
+    return tour
+
+
+def tsp_anytime(graph, start=0, time_limit=None):
+    # Generator of ever better (cost, cycle, optimal) tours. The first one
+    # comes from nearest neighbour + local search, then a depth-first
+    # branch and bound, cheapest edges first, prunes every branch whose
+    # g + heuristic() is no better than the best tour so far; the tours it
+    # finds are improved by local search before they are yielded. When the
+    # search space is exhausted the best tour is yielded once more with
+    # optimal True; with a time_limit (seconds) the generator may stop
+    # before that.
+    n = len(graph)
+    if n < 2:
+        return
+    deadline = time.perf_counter() + time_limit if time_limit is not None else math.inf
+    costs, neighbors = compile_graph(graph)
+    rows = costs.tolist()
+    # plain lists and Python ints: masks of 64 nodes or more don't fit NumPy
+    neighbor_lists = [nodes.tolist() for nodes in neighbors]
+    all_visited_mask = (1 << n) - 1
+    symmetric = bool(np.array_equal(costs, costs.T))
+
+    best_cost, best_cycle = math.inf, None
+    tour = nearest_neighbour_tour(rows, neighbors, start)
+    if tour is not None:
+        improve_tour(rows, tour, symmetric, deadline)
+        best_cost, best_cycle = tour_cost(rows, tour), tour
+        yield best_cost, best_cycle, False
+
+    # the MST is taken over the cheaper direction of every edge: a directed
+    # path through the unvisited nodes costs at least that MST, and the
+    # nodes are connected in it whenever such a path exists, so the bound
+    # holds (and the final tour is optimal) on directed graphs too
+    undirected_rows = np.minimum(costs, costs.T).tolist()
+
+    @lru_cache(maxsize=MST_CACHE_SIZE)
+    def mst_of(unvisited_mask):
+        return prim_mst(undirected_rows, [i for i in range(n) if unvisited_mask >> i & 1])
+
+    # path[d] is the node at depth d of the branch being searched
+    path = [start] * n
+    stack = [(start, 1 << start, 0.0, 0)]
+    searched = 0
+    while stack:
+        searched += 1
+        if searched % 256 == 0 and time.perf_counter() > deadline:
+            return
+        node, visited_mask, g, depth = stack.pop()
+        path[depth] = node
+
+        if visited_mask == all_visited_mask:
+            total = g + rows[node][start]
+            if total < best_cost:
+                tour = improve_tour(rows, path + [start], symmetric, deadline)
+                best_cost, best_cycle = tour_cost(rows, tour), tour
+                yield best_cost, best_cycle, False
+            continue
+
+        unvisited_mask = all_visited_mask & ~visited_mask
+        unvisited = [i for i in range(n) if unvisited_mask >> i & 1]
+        if g + heuristic(node, unvisited, costs, start, mst_of(unvisited_mask)) >= best_cost:
+            continue
+
+        # pushed most expensive first, so the cheapest edge is searched first
+        for nxt in reversed(neighbor_lists[node]):
+            if visited_mask >> nxt & 1:
+                continue
+            new_g = g + rows[node][nxt]
+            if new_g < best_cost:
+                stack.append((nxt, visited_mask | (1 << nxt), new_g, depth + 1))
+
+    if best_cycle is not None:
+        yield best_cost, best_cycle, True
+
+
+# Held-Karp keeps a float64 cost and an int8 parent per (subset, node)
+HELD_KARP_MAX_MEMORY = 1 << 30
+
+
+def held_karp_memory(n):
+    # peak bytes of tsp_held_karp for n nodes: the cost and parent tables,
+    # the int8 node count of every mask, and on top the larger of the int32
+    # temporaries that count them and the temporaries of one layer (its
+    # masks, and per end node the masks ending there with their m candidate
+    # costs, gathered and summed, while the previous end node's are still
+    # alive), plus the n x n cost matrices
+    m = max(n - 1, 0)
+    size = 1 << m
+    tables = size * m * 9 + size
+    counting = size * 12
+    layer = math.comb(m, m // 2)
+    ending = math.comb(m - 1, (m - 1) // 2) if m else 0
+    per_layer = size + layer * 24 + ending * (24 * m + 64)
+    return tables + max(counting, per_layer) + n * n * 24
+
+
+def tsp_held_karp(graph, start=0):
+    # Bitmask dynamic programming over the nodes other than start,
+    # relabelled 0..m-1: cost[mask, j] is the cheapest path that leaves
+    # start, visits exactly the nodes of mask and ends in j; parent[mask, j]
+    # is the node before j on it. A layer (all masks with the same number of
+    # nodes) only reads the layer below, so each layer is filled with one
+    # vectorized min-reduction per end node.
+    n = len(graph)
+    if n < 2:
+        return math.inf, []
+    costs, _ = compile_graph(graph)
+    others = np.array([v for v in range(n) if v != start])
+    m = len(others)
+    between = costs[np.ix_(others, others)]
+
+    size = 1 << m
+    cost = np.full((size, m), np.inf)
+    parent = np.full((size, m), -1, dtype=np.int8)
+    single = 1 << np.arange(m)
+    cost[single, np.arange(m)] = costs[start, others]
+
+    # nodes per mask; the int32 masks are only needed to count them
+    masks = np.arange(size, dtype=np.int32)
+    population = np.zeros(size, dtype=np.int8)
+    for j in range(m):
+        population += ((masks >> j) & 1).astype(np.int8)
+    del masks
+
+    for k in range(2, m + 1):
+        layer = np.flatnonzero(population == k)
+        for j in range(m):
+            ending = layer[(layer >> j) & 1 == 1]
+            previous = ending ^ (1 << j)
+            # nodes outside previous still hold inf there, they never win
+            candidates = cost[previous] + between[:, j]
+            best = candidates.argmin(axis=1)
+            cost[ending, j] = candidates[np.arange(len(ending)), best]
+            parent[ending, j] = best
+
+    full = size - 1
+    closing = cost[full] + costs[others, start]
+    last = int(closing.argmin())
+    total = float(closing[last])
+    if total == math.inf:
+        return math.inf, []
+
+    path = []
+    mask, j = full, last
+    while j != -1:
+        path.append(int(others[j]))
+        mask, j = mask ^ (1 << j), int(parent[mask, j])
+    return total, [start] + path[::-1] + [start]
+
+
+def choose_engine(graph):
+    # Held-Karp does the same 2^n * n^2 work whatever the graph looks like;
+    # A* with the MST bound is quick on sparse graphs and blows up on dense
+    # ones, where Held-Karp wins as long as its tables fit in memory. The
+    # MST bound is only admissible for symmetric costs, so directed graphs
+    # go to Held-Karp whenever it fits.
+    n = len(graph)
+    if held_karp_memory(n) > HELD_KARP_MAX_MEMORY:
+        return "astar"
+    costs, _ = compile_graph(graph)
+    if not np.array_equal(costs, costs.T):
+        return "held_karp"
+    edges = sum(len(neighbors) for neighbors in graph.values())
+    density = edges / (n * (n - 1)) if n > 1 else 1.0
+    if n <= 12 or density >= 0.4:
+        return "held_karp"
+    return "astar"
+
+
+ENGINES = {"astar": tsp_astar, "held_karp": tsp_held_karp}
+
+
+def solve(graph, start=0, engine="auto", measure_memory=False):
+    # Solve with one of ENGINES ("auto": choose_engine) and report what it
+    # took: (cost, cycle, {"engine", "seconds", "peak_memory"}). The peak
+    # memory is traced with tracemalloc, which slows A* down, so only on
+    # request (None otherwise). A* is only exact on symmetric (undirected)
+    # costs: on a directed graph its MST bound can overestimate, so it may
+    # return a worse cycle, or inf although a cycle exists. "auto" picks
+    # Held-Karp for those unless its tables don't fit in memory.
+    if engine == "auto":
+        engine = choose_engine(graph)
+    if measure_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        cost, cycle = ENGINES[engine](graph, start)
+        seconds = time.perf_counter() - started
+        peak_memory = tracemalloc.get_traced_memory()[1] if measure_memory else None
+    finally:
+        if measure_memory:
+            tracemalloc.stop()
+    return cost, cycle, {"engine": engine, "seconds": seconds, "peak_memory": peak_memory}
+
+
 if __name__ == "__main__":
     graph = {
         0: [(1, 14), (2, 9), (3, 7)],
@@ -96,9 +449,16 @@ if __name__ == "__main__":
         5: [(1, 6), (4, 8)]
     }
 
-    cost, cycle = tsp_astar(graph, start=0)
+    cost, cycle, report = solve(graph, start=0)
     if cost == math.inf:
         print("No Hamiltonian cycle exists")
     else:
         print("Optimal Hamiltonian Cycle:", cycle)
-        print("Minimum Cost:", cost)
\ No newline at end of file
+        print("Minimum Cost:", cost)
+
+    for cost, cycle, optimal in tsp_anytime(graph, start=0, time_limit=1.0):
+        print("anytime    cost %s%s: %s" % (cost, " (optimal)" if optimal else "", cycle))
+
+    for engine in ENGINES:
+        cost, cycle, report = solve(graph, start=0, engine=engine, measure_memory=True)
+        print("%-10s cost %s, %.4f s, peak memory %d KB" % (engine, cost, report["seconds"], report["peak_memory"] // 1024))
\ No newline at end of file
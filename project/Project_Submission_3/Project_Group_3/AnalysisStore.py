@@ -0,0 +1,85 @@
+"""
+Persistent analysis results on disk (SQLite), keyed by gs.zobristKey:
+position -> (depth, score, best move, PV). Openings and common structures
+come back in game after game; with a store installed findBestMoveMinMax
+answers them from disk instead of searching again, and writes back every
+search that went deeper than what was stored.
+
+Example:
+    SmartMoveFinder.analysis_store = AnalysisStore.AnalysisStore("analysis.db")
+    ...
+    SmartMoveFinder.analysis_store.close()
+
+Moves are stored as moveIDs, the PV as moveIDs separated by spaces. The
+Zobrist keys are the same in every process (fixed seed), so a store can be
+shared by several processes; SQLite does the locking.
+"""
+import sqlite3
+
+# writes are committed together, one transaction per position is far too slow
+COMMIT_EVERY = 100
+
+
+def _signed(key):
+    """SQLite integers are signed 64 bit, Zobrist keys are unsigned"""
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class AnalysisStore:
+    def __init__(self, path, commitEvery=COMMIT_EVERY):
+        self.path = path
+        # several worker processes may write to the same file
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS positions ("
+            "key INTEGER PRIMARY KEY, depth INTEGER, score REAL, best INTEGER, pv TEXT)"
+        )
+        self.connection.commit()
+        self.commitEvery = commitEvery
+        self.pendingWrites = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """(depth, score, bestMoveID, pvMoveIDs) stored for key, or None"""
+        row = self.connection.execute(
+            "SELECT depth, score, best, pv FROM positions WHERE key = ?", (_signed(key),)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        depth, score, best, pv = row
+        return depth, score, best, [int(moveID) for moveID in pv.split()]
+
+    def put(self, key, depth, score, bestMoveID, pvMoveIDs):
+        """Store a result unless the store already has one at least as deep"""
+        self.connection.execute(
+            "INSERT INTO positions (key, depth, score, best, pv) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET depth = excluded.depth, score = excluded.score, "
+            "best = excluded.best, pv = excluded.pv WHERE excluded.depth > positions.depth",
+            (_signed(key), depth, score, bestMoveID, " ".join(str(m) for m in pvMoveIDs)),
+        )
+        self.pendingWrites += 1
+        if self.pendingWrites >= self.commitEvery:
+            self.flush()
+
+    def flush(self):
+        if self.pendingWrites:
+            self.connection.commit()
+            self.pendingWrites = 0
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
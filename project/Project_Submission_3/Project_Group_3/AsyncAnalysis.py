@@ -0,0 +1,148 @@
+"""
+asyncio front end for the engine. The search itself is plain blocking
+Python, so it runs in an executor (a thread pool by default) while the event
+loop stays free to serve other requests. Every completed depth of the
+iterative deepening is streamed back as an AnalysisResult.
+
+Example:
+    analysis = AsyncAnalysis.analyse(gs, maxDepth=4)
+    async for result in analysis:
+        print(result.depth, result.score, result.pv, result.nodes)
+    # analysis.cancel() (or cancelling the awaiting task) stops the search
+"""
+import asyncio
+import copy
+import threading
+import time
+
+import SmartMoveFinder
+
+# marks the end of the result stream in the queue
+_DONE = object()
+
+
+class AnalysisResult:
+    """One completed iteration of the search"""
+
+    def __init__(self, depth, score, pv, nodes, elapsed, lines=None):
+        self.depth = depth
+        self.score = score  # positive is good for white, like scoreBoard
+        self.pv = pv  # list of Move objects, starting with the best move
+        self.nodes = nodes
+        self.elapsed = elapsed  # seconds since the analysis started
+        # multi-PV: ranked (move, score, pv) for the best root moves
+        self.lines = lines if lines is not None else [(self.bestMove, score, pv)]
+
+    @property
+    def bestMove(self):
+        return self.pv[0] if self.pv else None
+
+    def __repr__(self):
+        return "AnalysisResult(depth=%d, score=%.2f, pv=%s, nodes=%d)" % (
+            self.depth,
+            self.score,
+            " ".join(str(m) for m in self.pv),
+            self.nodes,
+        )
+
+
+class Analysis:
+    """
+    Async iterator over the results of one running search.
+    Leaving the loop early does not stop the search by itself; call
+    cancel() or use `async with` so the executor slot is given back.
+    """
+
+    def __init__(self, gs, maxDepth, executor=None, multiPV=1):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.stopEvent = threading.Event()
+        # the search makes and undoes moves on the board, so never hand it
+        # the caller's GameState
+        self.gs = copy.deepcopy(gs)
+        self.maxDepth = maxDepth
+        self.multiPV = multiPV
+        self.startTime = time.perf_counter()
+        self.future = self.loop.run_in_executor(executor, self._run)
+        self.finished = False
+
+    def _publish(self, item):
+        # called from the worker thread
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            # the event loop is already closed, nobody is listening anymore
+            self.stopEvent.set()
+
+    def _onDepth(self, info):
+        self._publish(
+            AnalysisResult(
+                info.depth,
+                info.bestScore,
+                list(info.pv),
+                info.nodes,
+                time.perf_counter() - self.startTime,
+                [(move, score, list(pv)) for move, score, pv in info.lines],
+            )
+        )
+
+    def _run(self):
+        try:
+            validMoves = self.gs.getValidMoves()
+            if validMoves:
+                info = SmartMoveFinder.SearchInfo(self.stopEvent)
+                SmartMoveFinder.searchIterative(
+                    self.gs, validMoves, self.maxDepth, info, self._onDepth, self.multiPV
+                )
+        finally:
+            self._publish(_DONE)
+
+    def cancel(self):
+        """Ask the search to stop, it will give up at the next node"""
+        self.stopEvent.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.finished:
+            raise StopAsyncIteration
+        try:
+            item = await self.queue.get()
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        if item is _DONE:
+            self.finished = True
+            # re-raise anything that went wrong inside the search
+            await self.future
+            raise StopAsyncIteration
+        return item
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.cancel()
+        # wait for the worker to leave the search, it only takes one node;
+        # errors from the search were already raised by __anext__
+        await asyncio.wait({self.future})
+
+
+def analyse(gs, maxDepth=SmartMoveFinder.MAX_DEPTH, executor=None, multiPV=1):
+    """
+    Start analysing gs in the background and return an Analysis to iterate.
+    Must be called from inside a running event loop. executor defaults to
+    the loop's default thread pool; pass your own to bound concurrency.
+    multiPV > 1 also reports the next best moves in every result's lines.
+    """
+    return Analysis(gs, maxDepth, executor, multiPV)
+
+
+async def bestMove(gs, maxDepth=SmartMoveFinder.MAX_DEPTH, executor=None):
+    """Convenience wrapper: the final AnalysisResult of a full analysis"""
+    last = None
+    async with analyse(gs, maxDepth, executor) as analysis:
+        async for result in analysis:
+            last = result
+    return last
@@ -3,6 +3,28 @@ This is responsible for storing all the information about the current state
 of the chess game. Also, be responsible for determining the valid moves at
 the current state. And it'll keep a move log.
 """
+import random
+
+# Zobrist hashing: one random 64 bit number per (piece, square), side to move,
+# castling rights combination and en passant file. XOR-ing the numbers of
+# everything on the board gives a position key that makeMove/undoMove keep
+# up to date cheaply. The seed is fixed so every process (the search worker,
+# saved analyses) computes the same keys.
+_zobristRandom = random.Random(304)
+zobristPieces = {
+    piece: [[_zobristRandom.getrandbits(64) for c in range(8)] for r in range(8)]
+    for piece in ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+}
+zobristBlackToMove = _zobristRandom.getrandbits(64)
+# indexed by CastleRights.index(): wks, bks, wqs, bqs as bits 0..3
+zobristCastling = [_zobristRandom.getrandbits(64) for i in range(16)]
+zobristEnpassant = [_zobristRandom.getrandbits(64) for c in range(8)]
+
+# a 4 bit code per piece, 0 is an empty square: packed boards (training
+# records, the session host) keep two squares in a byte
+pieceCodes = {"wp": 1, "wN": 2, "wB": 3, "wR": 4, "wQ": 5, "wK": 6, "bp": 9, "bN": 10, "bB": 11, "bR": 12, "bQ": 13, "bK": 14}
+codePieces = {code: piece for piece, code in pieceCodes.items()}
+codePieces[0] = "--"
 
 
 class GameState:
@@ -53,12 +75,167 @@ class GameState:
                 self.currentCastlingRights.bqs,
             )
         ]
+        # position hash, the log lets undoMove restore it without recomputing
+        self.zobristKey = self.computeZobristKey()
+        self.zobristLog = []
+        # hash of the pawns alone, it changes far less often (pawn hash table)
+        self.pawnKey = self.computePawnKey()
+        self.pawnKeyLog = []
+        # optional NNUE accumulator (NeuralEvaluator.attach), follows every move
+        self.accumulator = None
+        # plies played before moveLog starts (a position loaded from FEN)
+        self.startPly = 0
+
+    """ the position in Forsyth-Edwards Notation, the halfmove clock is not tracked (always 0) """
+
+    def getFEN(self):
+        rows = []
+        for r in range(8):
+            row = ""
+            empty = 0
+            for piece in self.board[r]:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += piece[1].upper() if piece[0] == "w" else piece[1].lower()
+            rows.append(row + str(empty) if empty else row)
+        rights = self.currentCastlingRights
+        castling = (
+            ("K" if rights.wks else "")
+            + ("Q" if rights.wqs else "")
+            + ("k" if rights.bks else "")
+            + ("q" if rights.bqs else "")
+        )
+        if self.enpassantPossible != ():
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        else:
+            enpassant = "-"
+        ply = self.startPly + len(self.moveLog)
+        return "%s %s %s %s 0 %d" % (
+            "/".join(rows),
+            "w" if self.whiteToMove else "b",
+            castling or "-",
+            enpassant,
+            ply // 2 + 1,
+        )
+
+    """ set up the position of a FEN string, the move log starts empty.
+    Raises ValueError if the string is not a FEN """
+
+    def loadFEN(self, fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("not a FEN: " + fen)
+        rows = fields[0].split("/")
+        if len(rows) != 8:
+            raise ValueError("not a FEN: " + fen)
+        board = []
+        for row in rows:
+            squares = []
+            for ch in row:
+                if ch.isdigit():
+                    squares.extend(["--"] * int(ch))
+                elif ch.upper() in "PNBRQK":
+                    piece = "p" if ch.upper() == "P" else ch.upper()
+                    squares.append(("w" if ch.isupper() else "b") + piece)
+                else:
+                    raise ValueError("not a FEN: " + fen)
+            if len(squares) != 8:
+                raise ValueError("not a FEN: " + fen)
+            board.append(squares)
+        castling = fields[2]
+        if fields[3] != "-":
+            enpassant = (Move.ranksToRows[fields[3][1]], Move.fileToCols[fields[3][0]])
+        else:
+            enpassant = ()
+        whiteToMove = fields[1] == "w"
+        fullmove = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+        self.loadPosition(
+            board,
+            whiteToMove,
+            CastleRights("K" in castling, "k" in castling, "Q" in castling, "q" in castling),
+            enpassant,
+            2 * (fullmove - 1) + (0 if whiteToMove else 1),
+        )
+
+    """ set up a position from its parts (board is a list of 8 rows, it is
+    used as is), the move log starts empty """
+
+    def loadPosition(self, board, whiteToMove, castleRights, enpassant=(), startPly=0):
+        self.board = board
+        self.whiteToMove = whiteToMove
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == "wK":
+                    self.whiteKingLocation = (r, c)
+                elif board[r][c] == "bK":
+                    self.blackKingLocation = (r, c)
+        self.currentCastlingRights = castleRights
+        self.castleRightLog = [CastleRights(castleRights.wks, castleRights.bks, castleRights.wqs, castleRights.bqs)]
+        self.enpassantPossible = enpassant
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.moveLog = []
+        self.checkmate = False
+        self.stalemate = False
+        self.zobristKey = self.computeZobristKey()
+        self.zobristLog = []
+        self.pawnKey = self.computePawnKey()
+        self.pawnKeyLog = []
+        # an attached accumulator belongs to the old position
+        self.accumulator = None
+        self.startPly = startPly
+
+    """ hash the whole position from scratch, makeMove keeps it updated after that """
+
+    def computeZobristKey(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    key ^= zobristPieces[piece][r][c]
+        if not self.whiteToMove:
+            key ^= zobristBlackToMove
+        key ^= zobristCastling[self.currentCastlingRights.index()]
+        if self.enpassantPossible != ():
+            key ^= zobristEnpassant[self.enpassantPossible[1]]
+        return key
+
+    def computePawnKey(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece[1] == "p":
+                    key ^= zobristPieces[piece][r][c]
+        return key
 
     """
     This functions takes a move as a parameter and executes it
     """
 
     def makeMove(self, move):
+        self.pawnKeyLog.append(self.pawnKey)
+        if move.pieceMoved[1] == "p":
+            self.pawnKey ^= zobristPieces[move.pieceMoved][move.startRow][move.startCol]
+            if not move.isPawnPromotion:
+                self.pawnKey ^= zobristPieces[move.pieceMoved][move.endRow][move.endCol]
+        if move.pieceCaptured[1] == "p":
+            captureRow = move.startRow if move.isEnpassantMove else move.endRow
+            self.pawnKey ^= zobristPieces[move.pieceCaptured][captureRow][move.endCol]
+        self.zobristLog.append(self.zobristKey)
+        key = self.zobristKey ^ zobristBlackToMove
+        key ^= zobristCastling[self.currentCastlingRights.index()]
+        if self.enpassantPossible != ():
+            key ^= zobristEnpassant[self.enpassantPossible[1]]
+        key ^= zobristPieces[move.pieceMoved][move.startRow][move.startCol]
+        if move.isEnpassantMove:
+            key ^= zobristPieces[move.pieceCaptured][move.startRow][move.endCol]
+        elif move.pieceCaptured != "--":
+            key ^= zobristPieces[move.pieceCaptured][move.endRow][move.endCol]
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         # log the move, so we can undo it later or print a PNG for the game
@@ -96,6 +273,15 @@ class GameState:
                     move.endCol - 2
                 ]
                 self.board[move.endRow][move.endCol - 2] = "--"  # remove the old rook
+            rook = move.pieceMoved[0] + "R"
+            if move.endCol - move.startCol == 2:
+                key ^= zobristPieces[rook][move.endRow][move.endCol + 1]
+                key ^= zobristPieces[rook][move.endRow][move.endCol - 1]
+            else:
+                key ^= zobristPieces[rook][move.endRow][move.endCol - 2]
+                key ^= zobristPieces[rook][move.endRow][move.endCol + 1]
+        # the piece on the landing square (the queen after a promotion)
+        key ^= zobristPieces[self.board[move.endRow][move.endCol]][move.endRow][move.endCol]
         # update the enpassantPossibleLog
         self.enpassantPossibleLog.append(self.enpassantPossible)
         # update the castling rights whenever its a rook or a king move
@@ -108,6 +294,12 @@ class GameState:
                 self.currentCastlingRights.bqs,
             )
         )
+        key ^= zobristCastling[self.currentCastlingRights.index()]
+        if self.enpassantPossible != ():
+            key ^= zobristEnpassant[self.enpassantPossible[1]]
+        self.zobristKey = key
+        if self.accumulator is not None:
+            self.accumulator.push(move)
 
     """ undo the last move made on the board """
 
@@ -115,6 +307,10 @@ class GameState:
         # first let's make sure that there's a move to undo
         if len(self.moveLog) != 0:
             move = self.moveLog.pop()
+            self.zobristKey = self.zobristLog.pop()
+            self.pawnKey = self.pawnKeyLog.pop()
+            if self.accumulator is not None:
+                self.accumulator.pop()
             self.board[move.startRow][move.startCol] = move.pieceMoved
             self.board[move.endRow][move.endCol] = move.pieceCaptured
             self.whiteToMove = not self.whiteToMove  # switch turns
@@ -219,13 +415,9 @@ class GameState:
             self.makeMove(moves[i])
             # 3. generate all opponent's moves
             # 4. for each of those moves, check if they attack your king
-            # we need this as the makeMove() did swap the players once
-            self.whiteToMove = not self.whiteToMove
-            if self.inCheck():
+            if self.movedIntoCheck():
                 # 5. if they do, it's not a valid move
                 moves.remove(moves[i])
-            # we need this to return every thing as before
-            self.whiteToMove = not self.whiteToMove
             self.undoMove()
         # do we have a checkmate |:) or stalemate (:|
         if len(moves) == 0:
@@ -249,6 +441,101 @@ class GameState:
         self.currentCastlingRights = tempCastleRights
         return moves
 
+    """ the move in standard algebraic notation (SAN): Nbd7, exd8=Q+, O-O#
+    validMoves are the legal moves of the current position, generated if not given """
+
+    def getSAN(self, move, validMoves=None):
+        if validMoves is None:
+            validMoves = self.getValidMoves()
+        san = str(move)
+        if not move.isCastleMove and move.pieceMoved[1] != "p":
+            # another piece of the same kind can go to the same square
+            others = [
+                m
+                for m in validMoves
+                if m.pieceMoved == move.pieceMoved
+                and m.endRow == move.endRow
+                and m.endCol == move.endCol
+                and m.moveID != move.moveID
+            ]
+            if others:
+                if all(m.startCol != move.startCol for m in others):
+                    fromSquare = move.colsToFiles[move.startCol]
+                elif all(m.startRow != move.startRow for m in others):
+                    fromSquare = move.rowsToRanks[move.startRow]
+                else:
+                    fromSquare = move.getRankFile(move.startRow, move.startCol)
+                san = san[0] + fromSquare + san[1:]
+        # check or checkmate, the position after the move tells
+        checkmate, stalemate = self.checkmate, self.stalemate
+        self.makeMove(move)
+        if self.inCheck():
+            san += "#" if len(self.getValidMoves()) == 0 else "+"
+        self.undoMove()
+        self.checkmate, self.stalemate = checkmate, stalemate
+        return san
+
+    """ the legal move a SAN string stands for, ValueError if there is none (or more than one) """
+
+    def parseSAN(self, san, validMoves=None):
+        if validMoves is None:
+            validMoves = self.getValidMoves()
+        text = san.rstrip("+#!?")
+        if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            endCol = 6 if len(text) == 3 else 2
+            for m in validMoves:
+                if m.isCastleMove and m.endCol == endCol:
+                    return m
+            raise ValueError("illegal castling: " + san)
+        # [piece][from file][from rank][x]to square[=promotion], e.g. Nbd7, exd8=Q, R1xa3
+        promotion = None
+        if len(text) > 2 and text[-1] in "NBRQ":
+            promotion = text[-1]
+            text = text[:-2] if text[-2] == "=" else text[:-1]
+        piece = text[0] if text[:1] in ("N", "B", "R", "Q", "K") else "p"
+        fromSquare = text[0 if piece == "p" else 1 : -2].replace("x", "")
+        toSquare = text[-2:]
+        fromFile = fromSquare[0] if fromSquare[:1] in Move.fileToCols else None
+        fromRank = fromSquare[-1] if fromSquare[-1:] in Move.ranksToRows else None
+        if (
+            len(toSquare) != 2
+            or toSquare[0] not in Move.fileToCols
+            or toSquare[1] not in Move.ranksToRows
+            or len(fromSquare) != (fromFile is not None) + (fromRank is not None)
+        ):
+            raise ValueError("not a SAN move: " + san)
+        endRow = Move.ranksToRows[toSquare[1]]
+        endCol = Move.fileToCols[toSquare[0]]
+        candidates = [
+            m
+            for m in validMoves
+            if m.pieceMoved[1] == piece
+            and m.endRow == endRow
+            and m.endCol == endCol
+            and not m.isCastleMove
+            and (fromFile is None or m.startCol == Move.fileToCols[fromFile])
+            and (fromRank is None or m.startRow == Move.ranksToRows[fromRank])
+        ]
+        if len(candidates) != 1:
+            raise ValueError(("ambiguous" if candidates else "illegal") + " move: " + san)
+        if promotion is not None and not candidates[0].isPawnPromotion:
+            raise ValueError("not a promotion: " + san)
+        # makeMove always promotes to a queen
+        if promotion is not None and promotion != "Q":
+            raise ValueError("underpromotion is not supported: " + san)
+        return candidates[0]
+
+    """ right after makeMove: did that move leave the mover's own king attacked,
+    so the search can check legality only for the moves it really plays """
+
+    def movedIntoCheck(self):
+        # we need this as the makeMove() did swap the players once
+        self.whiteToMove = not self.whiteToMove
+        check = self.inCheck()
+        # we need this to return every thing as before
+        self.whiteToMove = not self.whiteToMove
+        return check
+
     """ to determine if the current player is in check """
 
     def inCheck(self):
@@ -519,9 +806,13 @@ class CastleRights:
         self.wqs = wqs
         self.bqs = bqs
 
+    def index(self):
+        """the four rights as a 0..15 number, used for hashing"""
+        return self.wks | self.bks << 1 | self.wqs << 2 | self.bqs << 3
+
 
 class Move:
-    ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "0": 0}
+    ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
 
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
 
@@ -580,13 +871,12 @@ class Move:
         if self.isCastleMove:
             return "O-O" if self.endCol == 6 else "O-O-O"
         endSquare = self.getRankFile(self.endRow, self.endCol)
-        # pawn moves, captures, promotion
+        # pawn moves, captures, promotion (always to a queen)
         if self.pieceMoved[1] == "p":
             if self.isCapture:
-                return self.colsToFiles[self.startCol] + "x" + endSquare
-            else:
-                return endSquare
-        # TODO add promotion, + sign for check, # for checkmate and two pieces can move to same square
+                endSquare = self.colsToFiles[self.startCol] + "x" + endSquare
+            return endSquare + "=Q" if self.isPawnPromotion else endSquare
+        # check marks and disambiguation depend on the position: GameState.getSAN
         # other piece moves, captures
         moveString = self.pieceMoved[1]
         if self.isCapture:
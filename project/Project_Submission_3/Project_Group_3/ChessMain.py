@@ -2,19 +2,16 @@
 This is our main driver. It will be responsible for handling user input
 and displaying the current GameState object.
 """
-import sys
-import time
-
-sys.path.append(".")
+import os
 
 import ChessEngine
 import SmartMoveFinder
+import SearchWorker
 
-from ChessEngine import *
-from SmartMoveFinder import *
-import pygame as p
-import os
-from multiprocessing import Process, Queue
+# pygame is imported by main(), not here: a search worker started with the
+# spawn method imports this module again (as __mp_main__) and must not pay
+# for, or even need, the GUI
+p = None
 
 # our current path information:
 current_path = os.path.dirname(__file__)  # Where your .py file is located
@@ -29,8 +26,10 @@ MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT
 # the chess board is 8x8 :)
 DIMENSION = 8
 SQ_SIZE = BOARD_HEIGHT // DIMENSION
-# for animation later on
+# frames per second while idle, and while a move is being animated
 MAX_FPS = 15
+ANIMATION_FPS = 60
+SECONDS_PER_SQUARE = 0.08  # how long the animation of a move takes per square
 IMAGES = {}
 
 
@@ -49,136 +48,31 @@ def loadImages():
         IMAGES[piece] = p.transform.scale(p.image.load(img), (SQ_SIZE, SQ_SIZE))
 
 
-def evaluatePosition(gs):
+def evaluatePosition(gs, materialScore, engineScores=None):
     """
-    Evaluate the current position
+    Evaluate the current position for the eval bar
     Returns a score where positive is good for white, negative for black
     Range: -1000 to +1000 (checkmate values)
+    engineScores holds the search worker's scores by gs.zobristKey; the
+    position's score from there is shown when the worker has searched it,
+    until then materialScore: the running material + PST score kept up to
+    date with SmartMoveFinder.material_pst_delta
     """
     # Check for game over
     if gs.checkmate:
-        return -1000 if gs.whiteToMove else 1000
+        return -SmartMoveFinder.CHECKMATE if gs.whiteToMove else SmartMoveFinder.CHECKMATE
     elif gs.stalemate:
-        return 0
-    
-    score = 0
-    
-    # Piece values
-    pieceScore = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
-    
-    # Position scores
-    knightScores = [
-        [1, 1, 1, 1, 1, 1, 1, 1],
-        [1, 2, 2, 2, 2, 2, 2, 1],
-        [1, 2, 3, 3, 3, 3, 2, 1],
-        [1, 2, 3, 4, 4, 3, 2, 1],
-        [1, 2, 3, 4, 4, 3, 2, 1],
-        [1, 2, 3, 3, 3, 3, 2, 1],
-        [1, 2, 2, 2, 2, 2, 2, 1],
-        [1, 1, 1, 1, 1, 1, 1, 1],
-    ]
-    
-    bishopScores = [
-        [4, 3, 2, 1, 1, 2, 3, 4],
-        [3, 4, 3, 2, 2, 3, 4, 3],
-        [2, 3, 4, 3, 3, 4, 3, 2],
-        [1, 2, 3, 4, 4, 3, 2, 1],
-        [1, 2, 3, 4, 4, 3, 2, 1],
-        [2, 3, 4, 3, 3, 4, 3, 2],
-        [3, 4, 3, 2, 2, 3, 4, 3],
-        [4, 3, 2, 1, 1, 2, 3, 4],
-    ]
-    
-    queenScores = [
-        [1, 1, 1, 3, 1, 1, 1, 1],
-        [1, 2, 3, 3, 3, 1, 1, 1],
-        [1, 4, 3, 3, 3, 4, 2, 1],
-        [1, 2, 3, 3, 3, 2, 2, 1],
-        [1, 2, 3, 3, 3, 2, 2, 1],
-        [1, 4, 3, 3, 3, 4, 2, 1],
-        [1, 1, 2, 3, 3, 1, 1, 1],
-        [1, 1, 1, 3, 1, 1, 1, 1],
-    ]
-    
-    rockScores = [
-        [4, 3, 4, 4, 4, 4, 3, 4],
-        [4, 4, 4, 4, 4, 4, 4, 4],
-        [1, 1, 2, 3, 3, 2, 1, 1],
-        [1, 2, 3, 4, 4, 3, 2, 1],
-        [1, 2, 3, 4, 4, 3, 2, 1],
-        [1, 1, 2, 3, 3, 2, 1, 1],
-        [4, 4, 4, 4, 4, 4, 4, 4],
-        [4, 3, 4, 4, 4, 4, 3, 4],
-    ]
-    
-    whitePawnScores = [
-        [8, 8, 8, 8, 8, 8, 8, 8],
-        [8, 8, 8, 8, 8, 8, 8, 8],
-        [5, 6, 6, 7, 7, 6, 6, 5],
-        [2, 3, 3, 5, 5, 3, 3, 2],
-        [1, 2, 3, 4, 4, 3, 2, 1],
-        [1, 1, 2, 3, 3, 2, 1, 1],
-        [1, 1, 1, 0, 0, 1, 1, 1],
-        [0, 0, 0, 0, 0, 0, 0, 0],
-    ]
-    
-    blackPawnScores = [
-        [0, 0, 0, 0, 0, 0, 0, 0],
-        [1, 1, 1, 0, 0, 1, 1, 1],
-        [1, 1, 2, 3, 3, 2, 1, 1],
-        [1, 2, 3, 4, 4, 3, 2, 1],
-        [2, 3, 3, 5, 5, 3, 3, 2],
-        [5, 6, 6, 7, 7, 6, 6, 5],
-        [8, 8, 8, 8, 8, 8, 8, 8],
-        [8, 8, 8, 8, 8, 8, 8, 8],
-    ]
-    
-    piecePositionScores = {
-        "N": knightScores,
-        "B": bishopScores,
-        "Q": queenScores,
-        "R": rockScores,
-        "bp": blackPawnScores,
-        "wp": whitePawnScores,
-    }
-    
-    # Calculate material and positional score
-    for row in range(len(gs.board)):
-        for col in range(len(gs.board[row])):
-            square = gs.board[row][col]
-            if square != "--":
-                piece = square[1]
-                color = square[0]
-                
-                # Material score
-                piece_value = pieceScore[piece]
-                
-                # Positional score
-                pos_score = 0
-                if piece != "K":
-                    piece_key = piece if piece != "p" else square
-                    pos_score = piecePositionScores[piece_key][row][col] * 0.1
-                
-                total = piece_value + pos_score
-                
-                if color == "w":
-                    score += total
-                else:
-                    score -= total
-    
-    # Bonus for having the move
-    if gs.whiteToMove:
-        score += 0.1
-    else:
-        score -= 0.1
-    
-    return score
+        return SmartMoveFinder.STALEMATE
+    if engineScores is not None and gs.zobristKey in engineScores:
+        return engineScores[gs.zobristKey]
+    return materialScore
 
 
-def drawEvaluationBar(screen, evaluation):
+def drawEvaluationBar(screen, evaluation, font):
     """
     Draw the evaluation bar on the left side of the board
     Similar to chess.com/lichess style
+    font is created once by the caller, SysFont lookups are slow
     """
     bar_rect = p.Rect(0, 0, EVAL_BAR_WIDTH, BOARD_HEIGHT)
     
@@ -220,8 +114,6 @@ def drawEvaluationBar(screen, evaluation):
     p.draw.rect(screen, p.Color(100, 100, 100), bar_rect, 2)
     
     # Draw evaluation text
-    font = p.font.SysFont("Arial", 14, True, False)
-    
     if evaluation >= 1000:
         eval_text = "M"  # Checkmate for white
         text_color = p.Color("white")
@@ -259,14 +151,19 @@ def drawEvaluationBar(screen, evaluation):
 
 
 def main():
+    global p
+    import pygame as p
+
     p.init()
     p.display.set_caption("Chess with Evaluation")
     screen = p.display.set_mode((EVAL_BAR_WIDTH + BOARD_WIDTH + MOVE_LOG_PANEL_WIDTH, BOARD_HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    moveLogFont = p.font.SysFont("Arial", 20, False, False)
-    gs = GameState()
+    renderer = BoardRenderer(screen)
+    gs = ChessEngine.GameState()
     validMoves = gs.getValidMoves()
+    # the valid moves of every earlier position, so undo doesn't regenerate them
+    validMovesLog = []
     # moveMade: a flag variable that keep tracks if a valid move has been made
     # so we can generate another new set of valid moves
     moveMade = False
@@ -284,9 +181,15 @@ def main():
     playerOne = True  # for white side
     playerTwo = False  # for black side - AI
     AIThinking = False
-    moveFinderProcess = None
+    AIResult = None  # an answer that arrived while a move was being animated
+    # one search process for the whole game, it ponders while the human thinks
+    searchWorker = SearchWorker.SearchWorker(ponder=True)
     moveUndone = False
     currentEvaluation = 0.0  # Track current position evaluation
+    # material + PST, updated by the delta of each move instead of a rescan
+    materialScore = SmartMoveFinder.material_pst_score(gs.board)
+    # the worker's search score of each position it answered, by zobristKey
+    engineScores = {}
     
     while running:
         humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
@@ -312,10 +215,12 @@ def main():
                     if (
                         len(playerClicks) == 2 and humanTurn
                     ):  # after the second click, we need to move
-                        move = Move(playerClicks[0], playerClicks[1], gs.board)
+                        move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
                         for i in range(len(validMoves)):
                             if move == validMoves[i]:
+                                validMovesLog.append(validMoves)
                                 gs.makeMove(validMoves[i])
+                                materialScore += SmartMoveFinder.material_pst_delta(validMoves[i])
                                 moveMade = True
                                 animate = True
                                 sqSelected = ()  # reset for the next turn
@@ -325,193 +230,328 @@ def main():
             # handling the key presses like ctrl+z, etc..
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:  # call undo when z is pressed
-                    gs.undoMove()
+                    if len(gs.moveLog) != 0:
+                        materialScore -= SmartMoveFinder.material_pst_delta(gs.moveLog[-1])
+                        gs.undoMove()
+                        # we're back in a position whose moves we already know
+                        validMoves = validMovesLog.pop()
                     sqSelected = ()
                     playerClicks = []
                     moveMade = True
                     animate = False
                     gameOver = False
-                    if AIThinking:
-                        moveFinderProcess.terminate()
-                        AIThinking = False
+                    # whatever the worker is searching or pondering is stale now
+                    searchWorker.stop()
+                    AIThinking = False
+                    AIResult = None
                     moveUndone = True
+                    renderer.cancelAnimation()
                 if e.key == p.K_r:  # reset the board when r is pressed
-                    gs = GameState()
+                    gs = ChessEngine.GameState()
                     validMoves = gs.getValidMoves()
+                    validMovesLog = []
+                    renderer.invalidate()
                     sqSelected = ()
                     playerClicks = []
                     moveMade = False
                     animate = False
                     gameOver = False
                     running = True
-                    if AIThinking:
-                        moveFinderProcess.terminate()
-                        AIThinking = False
+                    searchWorker.stop()
+                    AIThinking = False
+                    AIResult = None
                     moveUndone = False
                     currentEvaluation = 0.0
+                    materialScore = SmartMoveFinder.material_pst_score(gs.board)
+                    engineScores = {}
         
         # handle the AI move finder
         if not gameOver and not humanTurn and not moveUndone and not moveMade and not animate:
             if not AIThinking:
                 AIThinking = True
                 print("AI thinking...")
-                returnQueue = Queue()  # is used to pass data between threads
-                moveFinderProcess = Process(
-                    target=SmartMoveFinder.findBestMoveMinMax,
-                    args=(gs, validMoves, returnQueue),
-                )
-                moveFinderProcess.start()
+                searchWorker.search(gs, validMoves)
             
-            # Check if the process has finished
-            if not moveFinderProcess.is_alive():
-                print("AI done thinking")
-                AIMove = returnQueue.get()
+            # Check if the worker has answered, it may while a move is animated
+            if AIResult is None:
+                AIResult = searchWorker.poll()
+            # the answer is played once the previous move has been animated
+            if AIResult is not None and not renderer.animating():
+                result = AIResult
+                AIResult = None
+                print("AI done thinking" + (" (ponder hit)" if result.ponderHit else ""))
+                # use our own Move object, the worker's one went through a pickle
+                AIMove = None
+                for move in validMoves:
+                    if move == result.move:
+                        AIMove = move
+                searchedKey = gs.zobristKey
                 if AIMove is None:
                     AIMove = SmartMoveFinder.findRandomMoves(validMoves)
+                validMovesLog.append(validMoves)
                 gs.makeMove(AIMove)
+                if result.move is not None and AIMove == result.move:
+                    # the score of the searched position, it stays the same
+                    # along the principal variation after its best move
+                    engineScores[searchedKey] = result.score
+                    engineScores[gs.zobristKey] = result.score
+                materialScore += SmartMoveFinder.material_pst_delta(AIMove)
                 moveMade = True
                 animate = True
                 AIThinking = False
         
         # generate the new set of valid moves when a user makes a valid move
+        # (an undo already took them back from validMovesLog)
         if moveMade:
-            # CRITICAL FIX: Update evaluation IMMEDIATELY after move is made
-            currentEvaluation = evaluatePosition(gs)
-            
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
-            validMoves = gs.getValidMoves()
+                # played frame by frame by renderer.draw, the loop goes on
+                renderer.startAnimation(gs.moveLog[-1], p.time.get_ticks())
+            if not moveUndone:
+                validMoves = gs.getValidMoves()
+            # after getValidMoves, so checkmate / stalemate are up to date
+            currentEvaluation = evaluatePosition(gs, materialScore, engineScores)
             moveMade = False
             animate = False
             moveUndone = False
         
-        drawGameState(screen, gs, validMoves, sqSelected, moveLogFont, currentEvaluation)
-        
         # check if the game ends either by stalemate or by a checkmate
+        endText = None
         if gs.checkmate or gs.stalemate:
             gameOver = True
-            text = (
+            endText = (
                 "Stalemate"
                 if gs.stalemate
                 else "Black wins by checkmate"
                 if gs.whiteToMove
                 else "White wins by checkmate"
             )
-            drawEndGameText(screen, text)
-        
-        clock.tick(MAX_FPS)
-        p.display.flip()
-
-
-""" responsible for the all the graphics needed for a current game state """
 
+        # only the regions that changed since the last frame are repainted
+        dirtyRects = renderer.draw(
+            gs, validMoves, sqSelected, currentEvaluation, endText, p.time.get_ticks()
+        )
+        if dirtyRects:
+            p.display.update(dirtyRects)
 
-def drawGameState(screen, gs, validMoves, sqSelected, moveLogFont, evaluation):
-    # Draw evaluation bar first (leftmost)
-    drawEvaluationBar(screen, evaluation)
-    
-    # Draw board and pieces (shifted right by EVAL_BAR_WIDTH)
-    drawBoard(screen)  # draw the squares on the board
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    drawPieces(screen, gs.board)  # draw the pieces on the top of the board
-    
-    # Draw move log (rightmost)
-    drawMoveLog(screen, gs, moveLogFont)
-
-
-def drawBoard(screen):
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[(r + c) % 2]
-            # Shift board right by EVAL_BAR_WIDTH
-            p.draw.rect(
-                screen, color, 
-                p.Rect(EVAL_BAR_WIDTH + c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-            )
+        clock.tick(ANIMATION_FPS if renderer.animating() else MAX_FPS)
 
+    searchWorker.close()
 
-""" highlight the square selected and valid moves for the piece selected """
 
+class BoardRenderer:
+    """
+    Responsible for all the graphics needed for a current game state.
+    It remembers what it drew last frame and keeps the board background,
+    fonts and rendered move log lines as cached surfaces, so a frame where
+    nothing changed costs nothing and a move only repaints a few squares.
+    """
 
-def highlightSquares(screen, gs, validMoves, sqSelected):
-    if sqSelected != ():
-        r, c = sqSelected
-        # make sure that each user can use highlighting ability for its own pieces
-        if gs.board[r][c][0] == ("w" if gs.whiteToMove else "b"):
-            # 1. highlight the selected square
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(
-                100
-            )  # zero value is full transparent and 255 means no transparency
-            s.fill(p.Color("blue"))
-            screen.blit(s, (EVAL_BAR_WIDTH + c * SQ_SIZE, r * SQ_SIZE))
-            # 2. highlight moves from that selected square
-            s.fill(p.Color("yellow"))
-            for move in validMoves:
-                if (
-                    move.startRow == r and move.startCol == c
-                ):  # then those are the valid moves for that particular piece
-                    screen.blit(s, (EVAL_BAR_WIDTH + move.endCol * SQ_SIZE, move.endRow * SQ_SIZE))
-
-
-def drawPieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":  # it's really a piece and not an empty square
-                screen.blit(
-                    IMAGES[piece], 
-                    p.Rect(EVAL_BAR_WIDTH + c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    def __init__(self, screen):
+        self.screen = screen
+        self.evalFont = p.font.SysFont("Arial", 14, True, False)
+        self.moveLogFont = p.font.SysFont("Arial", 20, False, False)
+        self.endGameFont = p.font.SysFont("Helvetica", 32, True, False)
+        # the empty board is drawn once and then copied square by square
+        colors = [p.Color("white"), p.Color("gray")]
+        self.boardSurface = p.Surface((BOARD_WIDTH, BOARD_HEIGHT))
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                p.draw.rect(
+                    self.boardSurface,
+                    colors[(r + c) % 2],
+                    p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE),
                 )
-
-
-""" the animation function """
-
-
-def animateMove(move, screen, board, clock):
-    global colors
-    dR = move.endRow - move.startRow
-    dC = move.endCol - move.startCol
-    framesPerSquare = 10  # frames to move one square
-    frameCount = (abs(dR) + abs(dC)) * framesPerSquare
-    for frame in range(frameCount + 1):
-        r, c = (
-            move.startRow + dR * frame / frameCount,
-            move.startCol + dC * frame / frameCount,
-        )
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # erase the move from its ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = p.Rect(
-            EVAL_BAR_WIDTH + move.endCol * SQ_SIZE, move.endRow * SQ_SIZE, SQ_SIZE, SQ_SIZE
-        )
-        p.draw.rect(screen, color, endSquare)
-        # draw the captured piece back onto the top of the rect
-        if move.pieceCaptured != "--":
-            if move.isEnpassantMove:
-                enpassantRow = (
-                    (move.endRow + 1)
-                    if move.pieceCaptured[0] == "b"
-                    else (move.endRow - 1)
-                )
-                endSquare = p.Rect(
-                    EVAL_BAR_WIDTH + move.endCol * SQ_SIZE, enpassantRow * SQ_SIZE, SQ_SIZE, SQ_SIZE
-                )
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
-        # draw the moving piece
-        screen.blit(
-            IMAGES[move.pieceMoved], 
-            p.Rect(EVAL_BAR_WIDTH + c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        # zero value is full transparent and 255 means no transparency
+        self.highlightSurfaces = {}
+        for name in ("blue", "yellow"):
+            s = p.Surface((SQ_SIZE, SQ_SIZE))
+            s.set_alpha(100)
+            s.fill(p.Color(name))
+            self.highlightSurfaces[name] = s
+        self.boardRect = p.Rect(EVAL_BAR_WIDTH, 0, BOARD_WIDTH, BOARD_HEIGHT)
+        self.evalBarRect = p.Rect(0, 0, EVAL_BAR_WIDTH, BOARD_HEIGHT)
+        self.moveLogRect = p.Rect(
+            EVAL_BAR_WIDTH + BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT
         )
-        p.display.flip()
-        clock.tick(120)
-
-
-def drawEndGameText(screen, text):
-    font = p.font.SysFont("Helvetica", 32, True, False)
+        self.moveLogLines = {}  # text -> rendered surface
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget the last frame, the next draw() repaints everything"""
+        self.animation = None
+        self.spriteRect = None
+        self.lastBoard = None
+        self.lastHighlights = {}
+        self.lastEvaluation = None
+        self.lastMoveLogLength = -1
+        self.lastLoggedMove = None
+        self.lastEndText = None
+
+    # ----- move animation -----
+
+    def startAnimation(self, move, now):
+        """
+        Slide move (already made on the board) from its start square, over
+        the next frames. now and the times given to draw() are milliseconds.
+        """
+        squares = abs(move.endRow - move.startRow) + abs(move.endCol - move.startCol)
+        self.animation = (move, now, max(1, squares * SECONDS_PER_SQUARE * 1000))
+
+    def animating(self):
+        return self.animation is not None
+
+    def cancelAnimation(self):
+        if self.animation is not None:
+            self.invalidate()
+
+    def animationFrame(self, board, now):
+        """
+        Put what stays under the moving piece back on board (the flat list
+        draw() compares) and return (piece, pixel position) of the moving
+        piece, or None once the animation is over
+        """
+        move, start, duration = self.animation
+        progress = (now - start) / duration
+        if progress >= 1:
+            self.animation = None
+            return None
+        # the landing square keeps the captured piece until the piece arrives
+        board[move.endRow * DIMENSION + move.endCol] = "--" if move.isEnpassantMove else move.pieceCaptured
+        if move.isEnpassantMove:
+            board[move.startRow * DIMENSION + move.endCol] = move.pieceCaptured
+        r = move.startRow + (move.endRow - move.startRow) * progress
+        c = move.startCol + (move.endCol - move.startCol) * progress
+        return move.pieceMoved, (EVAL_BAR_WIDTH + round(c * SQ_SIZE), round(r * SQ_SIZE))
+
+    def squaresUnder(self, rect):
+        """Board squares (row, col) a screen rect overlaps"""
+        firstCol = (rect.left - EVAL_BAR_WIDTH) // SQ_SIZE
+        lastCol = (rect.right - 1 - EVAL_BAR_WIDTH) // SQ_SIZE
+        firstRow = rect.top // SQ_SIZE
+        lastRow = (rect.bottom - 1) // SQ_SIZE
+        return [
+            (r, c)
+            for r in range(max(firstRow, 0), min(lastRow, DIMENSION - 1) + 1)
+            for c in range(max(firstCol, 0), min(lastCol, DIMENSION - 1) + 1)
+        ]
+
+    def draw(self, gs, validMoves, sqSelected, evaluation, endText=None, now=0):
+        """Repaint what changed and return the dirty rects for display.update"""
+        dirty = []
+        board = [sq for row in gs.board for sq in row]
+        highlights = self.highlightedSquares(gs, validMoves, sqSelected)
+        sprite = self.animationFrame(board, now) if self.animation is not None else None
+        if sprite is not None:
+            # the end of the game is shown once the last move has landed
+            endText = None
+
+        if self.lastBoard is None or endText != self.lastEndText:
+            changed = range(DIMENSION * DIMENSION)
+        else:
+            changed = [i for i in range(DIMENSION * DIMENSION) if board[i] != self.lastBoard[i]]
+            for sq in set(highlights) | set(self.lastHighlights):
+                if highlights.get(sq) != self.lastHighlights.get(sq):
+                    changed.append(sq[0] * DIMENSION + sq[1])
+            # the end game text lies over the board, repaint it all under it
+            if endText is not None and changed:
+                changed = range(DIMENSION * DIMENSION)
+        # the squares the moving piece covered last frame and covers now
+        if self.spriteRect is not None:
+            changed = list(changed)
+            for r, c in self.squaresUnder(self.spriteRect):
+                changed.append(r * DIMENSION + c)
+            dirty.append(self.spriteRect)
+            self.spriteRect = None
+        if sprite is not None:
+            self.spriteRect = p.Rect(sprite[1], (SQ_SIZE, SQ_SIZE))
+            changed = list(changed)
+            for r, c in self.squaresUnder(self.spriteRect):
+                changed.append(r * DIMENSION + c)
+        if changed:
+            for i in set(changed):
+                dirty.append(self.drawSquare(i // DIMENSION, i % DIMENSION, board[i], highlights))
+            if endText is not None:
+                drawEndGameText(self.screen, endText, self.endGameFont)
+            if len(dirty) >= DIMENSION * DIMENSION:
+                dirty = [self.boardRect]
+        if sprite is not None:
+            self.screen.blit(IMAGES[sprite[0]], self.spriteRect)
+        self.lastBoard = board
+        self.lastHighlights = highlights
+        self.lastEndText = endText
+
+        if evaluation != self.lastEvaluation:
+            drawEvaluationBar(self.screen, evaluation, self.evalFont)
+            dirty.append(self.evalBarRect)
+            self.lastEvaluation = evaluation
+
+        # a move made or undone changes the length or the last move object
+        moveLog = gs.moveLog
+        lastLoggedMove = moveLog[-1] if moveLog else None
+        if len(moveLog) != self.lastMoveLogLength or lastLoggedMove is not self.lastLoggedMove:
+            self.drawMoveLog(moveLog)
+            dirty.append(self.moveLogRect)
+            self.lastMoveLogLength = len(moveLog)
+            self.lastLoggedMove = lastLoggedMove
+        return dirty
+
+    def drawSquare(self, r, c, piece, highlights):
+        rect = p.Rect(EVAL_BAR_WIDTH + c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.boardSurface, rect, p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+        if (r, c) in highlights:
+            self.screen.blit(self.highlightSurfaces[highlights[(r, c)]], rect)
+        if piece != "--":  # it's really a piece and not an empty square
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
+
+    """ highlight the square selected and valid moves for the piece selected """
+
+    def highlightedSquares(self, gs, validMoves, sqSelected):
+        highlights = {}
+        if sqSelected != ():
+            r, c = sqSelected
+            # make sure that each user can use highlighting ability for its own pieces
+            if gs.board[r][c][0] == ("w" if gs.whiteToMove else "b"):
+                # 1. highlight the selected square
+                highlights[(r, c)] = "blue"
+                # 2. highlight moves from that selected square
+                for move in validMoves:
+                    if (
+                        move.startRow == r and move.startCol == c
+                    ):  # then those are the valid moves for that particular piece
+                        highlights[(move.endRow, move.endCol)] = "yellow"
+        return highlights
+
+    def drawMoveLog(self, moveLog):
+        p.draw.rect(self.screen, p.Color("black"), self.moveLogRect)
+        moveTexts = []
+        for i in range(0, len(moveLog), 2):
+            moveString = str(i // 2 + 1) + ". " + str(moveLog[i]) + " "
+            if i + 1 < len(moveLog):
+                moveString += str(moveLog[i + 1])
+            moveTexts.append(moveString)
+        padding = 5
+        textY = padding
+        lineSpacing = 5
+        movesPerRow = 3
+        lines = {}
+        for i in range(0, len(moveTexts), movesPerRow):
+            text = ""
+            for j in range(movesPerRow):
+                if i + j < len(moveTexts):
+                    text += moveTexts[i + j] + "  "
+            # only the last line changes while the game goes on
+            textObject = self.moveLogLines.get(text)
+            if textObject is None:
+                textObject = self.moveLogFont.render(text, True, p.Color("white"))
+            lines[text] = textObject
+            textLocation = self.moveLogRect.move(padding, textY)
+            self.screen.blit(textObject, textLocation)
+            textY += textObject.get_height() + lineSpacing
+        self.moveLogLines = lines
+
+
+def drawEndGameText(screen, text, font):
     textObject = font.render(text, 0, p.Color("Gray"))
     textLocation = p.Rect(EVAL_BAR_WIDTH, 0, BOARD_WIDTH, BOARD_HEIGHT).move(
         EVAL_BAR_WIDTH + BOARD_WIDTH / 2 - textObject.get_width() / 2,
@@ -522,34 +562,6 @@ def drawEndGameText(screen, text):
     screen.blit(textObject, textLocation.move(2, 2))
 
 
-def drawMoveLog(screen, gs, font):
-    moveLogRect = p.Rect(
-        EVAL_BAR_WIDTH + BOARD_WIDTH, 0, 
-        MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT
-    )
-    p.draw.rect(screen, p.Color("black"), moveLogRect)
-    moveLog = gs.moveLog
-    moveTexts = []
-    for i in range(0, len(moveLog), 2):
-        moveString = str(i // 2 + 1) + ". " + str(moveLog[i]) + " "
-        if i + 1 < len(moveLog):
-            moveString += str(moveLog[i + 1])
-        moveTexts.append(moveString)
-    padding = 5
-    textY = padding
-    lineSpacing = 5
-    movesPerRow = 3
-    for i in range(0, len(moveTexts), movesPerRow):
-        text = ""
-        for j in range(movesPerRow):
-            if i + j < len(moveTexts):
-                text += moveTexts[i + j] + "  "
-        textObject = font.render(text, True, p.Color("white"))
-        textLocation = moveLogRect.move(padding, textY)
-        screen.blit(textObject, textLocation)
-        textY += textObject.get_height() + lineSpacing
-
-
 if __name__ == "__main__":
     main()
 
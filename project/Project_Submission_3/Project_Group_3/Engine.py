@@ -0,0 +1,77 @@
+"""
+The engine without the GUI: rules and search, for search workers, scripts
+and tests. It imports ChessEngine and SmartMoveFinder and nothing else
+(no pygame, no multiprocessing, no numpy); their tables (Zobrist keys,
+material + PST) are built once when they are imported.
+
+Example:
+    import Engine
+    gs = Engine.GameState()
+    info = Engine.analyse(gs, depth=3)
+    print(info.bestMove, info.bestScore, info.pv)
+
+python Engine.py [FEN] [--depth N] [--hash "256 MB"] prints the best move,
+the PV, how long the import and the search took and how full the search
+tables are.
+"""
+import time
+
+_importStart = time.perf_counter()
+
+from ChessEngine import CastleRights, GameState, Move
+from SmartMoveFinder import (
+    CHECKMATE,
+    MAX_DEPTH,
+    STALEMATE,
+    SearchInfo,
+    SearchStopped,
+    cache_report,
+    clear_caches,
+    findBestMoveMinMax,
+    findBestMovesMultiPV,
+    parse_size,
+    scoreBoard,
+    searchIterative,
+    set_cache_budget,
+)
+
+# seconds the engine modules took to import, in this process
+importTime = time.perf_counter() - _importStart
+
+
+def analyse(gs, depth=MAX_DEPTH, stopEvent=None):
+    """Search gs to depth and return the SearchInfo (bestMove, bestScore, pv, nodes)"""
+    info = SearchInfo(stopEvent)
+    validMoves = gs.getValidMoves()
+    if validMoves:
+        searchIterative(gs, validMoves, depth, info)
+    return info
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Search a position without the GUI")
+    parser.add_argument("fen", nargs="*", help="the position, default: the starting position")
+    parser.add_argument("--depth", type=int, default=MAX_DEPTH)
+    parser.add_argument("--hash", type=parse_size, default=None, help='memory of the search tables, e.g. "256 MB"')
+    args = parser.parse_args(argv)
+    if args.hash is not None:
+        set_cache_budget(args.hash)
+    gs = GameState()
+    if args.fen:
+        gs.loadFEN(" ".join(args.fen))
+    startTime = time.perf_counter()
+    info = analyse(gs, args.depth)
+    elapsed = time.perf_counter() - startTime
+    print("bestmove %s score %.2f depth %d pv %s" % (info.bestMove, info.bestScore, info.depth, " ".join(str(m) for m in info.pv)))
+    print("import %.1f ms, search %.2f s, %d nodes" % (importTime * 1000, elapsed, info.nodes))
+    for name, stats in cache_report().items():
+        print(
+            "%-20s %7d / %7d entries  %6.1f MB  hit rate %.2f"
+            % (name, stats["entries"], stats["capacity"], stats["bytes"] / (1 << 20), stats["hit_rate"])
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Optional NNUE style evaluator in NumPy, used by scoreBoard instead of the
+handcrafted terms once a GameState has an accumulator attached.
+
+Network:
+    768 inputs, one per (piece, square) from one side's point of view
+    -> accumulator of HIDDEN values, one per perspective (white / black)
+    -> clipped ReLU, side to move first: 2 * HIDDEN values
+    -> dense DENSE, clipped ReLU -> dense 1 = score in pawns for the side to move
+
+The first layer is a sum of weight rows, one per piece on the board, so a
+move only adds / subtracts a few rows instead of recomputing it: the
+accumulator follows makeMove / undoMove through gs.accumulator. A pushed
+move is only recorded; the rows are applied when a position is evaluated,
+so the make/undo pairs of move generation (legality checks) cost nothing.
+
+Trained weights are loaded from an .npz file (loadNetwork / saveNetwork).
+Network.fromTables() builds a network that reproduces material + PST
+exactly, a sensible starting point for training.
+
+Example:
+    NeuralEvaluator.attach(gs, NeuralEvaluator.loadNetwork("nnue.npz"))
+    SmartMoveFinder.findBestMoveMinMax(gs, gs.getValidMoves())
+
+python NeuralEvaluator.py benchmarks evals/sec against scoreBoard.
+"""
+import random
+import time
+
+import numpy as np
+
+import ChessEngine
+import SmartMoveFinder
+
+HIDDEN = 128
+DENSE = 32
+# canonical piece order: the perspective's own pieces first
+PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+INPUTS = len(PIECES) * 64
+# input feature of (piece, row, col): [white perspective, black perspective]
+# black sees the board with colors swapped and rows flipped
+featureIndex = {}
+for _i, _piece in enumerate(PIECES):
+    _mirrored = PIECES.index(("b" if _piece[0] == "w" else "w") + _piece[1])
+    for _r in range(8):
+        for _c in range(8):
+            featureIndex[(_piece, _r, _c)] = (
+                _i * 64 + _r * 8 + _c,
+                _mirrored * 64 + (7 - _r) * 8 + _c,
+            )
+
+
+class Network:
+    """The weights: w1 (INPUTS, hidden), w2 (2 * hidden, dense), w3 (dense,)"""
+
+    def __init__(self, w1, b1, w2, b2, w3, b3):
+        self.w1 = np.ascontiguousarray(w1, dtype=np.float32)
+        self.b1 = np.asarray(b1, dtype=np.float32)
+        self.w2 = np.asarray(w2, dtype=np.float32)
+        self.b2 = np.asarray(b2, dtype=np.float32)
+        self.w3 = np.asarray(w3, dtype=np.float32).reshape(-1)
+        self.b3 = float(b3)
+        hidden = self.w1.shape[1]
+        if (
+            self.w1.shape[0] != INPUTS
+            or self.b1.shape != (hidden,)
+            or self.w2.shape[0] != 2 * hidden
+            or self.b2.shape != (self.w2.shape[1],)
+            or self.w3.shape != (self.w2.shape[1],)
+        ):
+            raise ValueError("inconsistent network shapes")
+
+    @classmethod
+    def random(cls, hidden=HIDDEN, dense=DENSE, seed=0):
+        rng = np.random.default_rng(seed)
+        return cls(
+            rng.normal(0, 0.05, (INPUTS, hidden)),
+            np.zeros(hidden),
+            rng.normal(0, 1 / np.sqrt(2 * hidden), (2 * hidden, dense)),
+            np.zeros(dense),
+            rng.normal(0, 1 / np.sqrt(dense), dense),
+            0.0,
+        )
+
+    @classmethod
+    def fromTables(cls, hidden=HIDDEN, dense=DENSE, scale=128.0):
+        """
+        Material + PST (SmartMoveFinder.squareScores) as a network: hidden
+        unit 0 sums the perspective's own pieces, unit 1 the opponent's,
+        both divided by scale to stay inside the clipped ReLU.
+        """
+        w1 = np.zeros((INPUTS, hidden))
+        for (piece, r, c), (index, _) in featureIndex.items():
+            unit = 0 if piece[0] == "w" else 1
+            w1[index, unit] = abs(SmartMoveFinder.squareScores[piece][r][c]) / scale
+        w2 = np.zeros((2 * hidden, dense))
+        w2[0, 0] = 1.0  # side to move: own pieces
+        w2[1, 1] = 1.0  # side to move: opponent's pieces
+        w3 = np.zeros(dense)
+        w3[0], w3[1] = scale, -scale
+        return cls(w1, np.zeros(hidden), w2, np.zeros(dense), w3, 0.0)
+
+    def refresh(self, board):
+        """Both accumulators computed from scratch"""
+        white, black = [], []
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece != "--":
+                    w, b = featureIndex[(piece, r, c)]
+                    white.append(w)
+                    black.append(b)
+        return self.b1 + self.w1[white].sum(axis=0), self.b1 + self.w1[black].sum(axis=0)
+
+    def forward(self, own, other):
+        """Score for the side to move from its accumulator and the opponent's"""
+        x = np.clip(np.concatenate((own, other)), 0.0, 1.0)
+        h = np.clip(x @ self.w2 + self.b2, 0.0, 1.0)
+        return float(h @ self.w3) + self.b3
+
+
+def loadNetwork(path):
+    """A Network from an .npz file with arrays w1, b1, w2, b2, w3, b3"""
+    with np.load(path) as data:
+        try:
+            return Network(*(data[name] for name in ("w1", "b1", "w2", "b2", "w3", "b3")))
+        except KeyError as e:
+            raise ValueError("%s is not a network file, missing %s" % (path, e))
+
+
+def saveNetwork(network, path):
+    np.savez(
+        path,
+        w1=network.w1,
+        b1=network.b1,
+        w2=network.w2,
+        b2=network.b2,
+        w3=network.w3,
+        b3=np.float32(network.b3),
+    )
+
+
+def moveFeatures(move):
+    """(added, removed) (piece, row, col) features of a move"""
+    removed = [(move.pieceMoved, move.startRow, move.startCol)]
+    if move.isEnpassantMove:
+        removed.append((move.pieceCaptured, move.startRow, move.endCol))
+    elif move.pieceCaptured != "--":
+        removed.append((move.pieceCaptured, move.endRow, move.endCol))
+    landed = move.pieceMoved[0] + "Q" if move.isPawnPromotion else move.pieceMoved
+    added = [(landed, move.endRow, move.endCol)]
+    if move.isCastleMove:
+        rook = move.pieceMoved[0] + "R"
+        if move.endCol - move.startCol == 2:  # king side
+            rookFrom, rookTo = move.endCol + 1, move.endCol - 1
+        else:  # queen side
+            rookFrom, rookTo = move.endCol - 2, move.endCol + 1
+        removed.append((rook, move.endRow, rookFrom))
+        added.append((rook, move.endRow, rookTo))
+    return added, removed
+
+
+class Accumulator:
+    """
+    First layer values kept in step with a GameState. makeMove pushes,
+    undoMove pops; a stack entry is [move, white, black] where the vectors
+    are None until evaluate() needs them.
+    """
+
+    def __init__(self, network, gs):
+        self.network = network
+        white, black = network.refresh(gs.board)
+        self.stack = [[None, white, black]]
+
+    def push(self, move):
+        self.stack.append([move, None, None])
+
+    def pop(self):
+        if len(self.stack) > 1:
+            self.stack.pop()
+
+    def _update(self):
+        stack = self.stack
+        last = len(stack) - 1
+        computed = last
+        while stack[computed][1] is None:
+            computed -= 1
+        w1 = self.network.w1
+        white, black = stack[computed][1], stack[computed][2]
+        for entry in stack[computed + 1 :]:
+            added, removed = moveFeatures(entry[0])
+            addW, addB = zip(*(featureIndex[f] for f in added))
+            removeW, removeB = zip(*(featureIndex[f] for f in removed))
+            white = white + w1[list(addW)].sum(axis=0) - w1[list(removeW)].sum(axis=0)
+            black = black + w1[list(addB)].sum(axis=0) - w1[list(removeB)].sum(axis=0)
+            entry[1], entry[2] = white, black
+        return white, black
+
+    def evaluate(self, gs):
+        """Score of gs in pawns, positive is good for white like scoreBoard"""
+        white, black = self._update()
+        if gs.whiteToMove:
+            return self.network.forward(white, black)
+        return -self.network.forward(black, white)
+
+
+def attach(gs, network):
+    """
+    Evaluate gs (and every position searched from it) with network. The
+    transposition table is keyed by position only, so the scores of the
+    other evaluator are dropped from it.
+    """
+    gs.accumulator = Accumulator(network, gs)
+    SmartMoveFinder.transposition_table.clear()
+    return gs.accumulator
+
+
+def detach(gs):
+    gs.accumulator = None
+    SmartMoveFinder.transposition_table.clear()
+
+
+def benchmark(network=None, positions=200, seed=1):
+    """
+    Evaluations per second of scoreBoard and of the network, over positions
+    from random games. The network is timed the way the search uses it: make
+    a move, evaluate, undo. Returns {"scoreBoard": evals/s, "nnue": evals/s}.
+    """
+    if network is None:
+        network = Network.random()
+    rng = random.Random(seed)
+    gs = ChessEngine.GameState()
+    samples = []  # (position moves, the move evaluated after them)
+    while len(samples) < positions:
+        moves = gs.getValidMoves()
+        if not moves or len(gs.moveLog) >= 80:
+            gs = ChessEngine.GameState()
+            continue
+        samples.append((list(gs.moveLog), rng.choice(moves)))
+        gs.makeMove(rng.choice(moves))
+
+    def timeEvaluations(evaluate, prepare):
+        total = 0.0
+        for moveLog, move in samples:
+            gs = ChessEngine.GameState()
+            for m in moveLog:
+                gs.makeMove(m)
+            prepare(gs)
+            start = time.perf_counter()
+            gs.makeMove(move)
+            evaluate(gs)
+            gs.undoMove()
+            total += time.perf_counter() - start
+        return len(samples) / total
+
+    def noCache(gs):
+        SmartMoveFinder.eval_cache.clear()
+        SmartMoveFinder.attack_cache.clear()
+
+    return {
+        "scoreBoard": timeEvaluations(SmartMoveFinder.scoreBoard, noCache),
+        "nnue": timeEvaluations(lambda gs: gs.accumulator.evaluate(gs), lambda gs: attach(gs, network)),
+    }
+
+
+if __name__ == "__main__":
+    for name, rate in benchmark().items():
+        print("%-10s %8.0f evals/s" % (name, rate))
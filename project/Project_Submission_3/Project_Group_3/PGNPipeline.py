@@ -0,0 +1,363 @@
+"""
+Streaming analysis of PGN archives. Games are read lazily one at a time,
+replayed through GameState and every position is searched at a fixed depth
+(or for a fixed time per move) in a pool of worker processes. The results
+are written as JSON lines or as PGN with the evaluations in comments.
+
+Memory stays bounded whatever the archive size: only a few games per worker
+are in flight at once, and results are written in order as they complete.
+A task is a whole game (a list of SAN strings, cheap to send): the worker
+replays it once and searches its positions one after the other, which also
+keeps the transposition table warm between consecutive positions.
+
+Usage:
+    python PGNPipeline.py games.pgn -o analysis.jsonl --depth 3
+    python PGNPipeline.py games.pgn -o annotated.pgn --format pgn --time 0.5
+    python PGNPipeline.py games.pgn -o analysis.jsonl --store analysis.db
+With --store, positions already analysed (in this or an earlier run) to the
+requested depth are read from the AnalysisStore instead of searched.
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import AnalysisStore
+import ChessEngine
+import SmartMoveFinder
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+# games in flight per worker process: enough to keep them busy, no more
+GAMES_PER_WORKER = 2
+# results buffered before they are written out together
+WRITE_BATCH = 64
+
+
+class PGNGame:
+    """Tag pairs and SAN moves of one game, as read from the file"""
+
+    def __init__(self, headers, moves, result):
+        self.headers = headers  # dict, in file order
+        self.moves = moves  # list of SAN strings
+        self.result = result
+
+
+# ---------- reading ----------
+
+
+def _tokens(lines):
+    """
+    Move text tokens of one game at a time: yields ("tag", name, value) for
+    tag pairs and ("move", san) / ("result", text) for the move text.
+    Comments, NAGs, move numbers and variations are dropped on the way.
+    """
+    comment = False  # inside a {...} comment, they can span lines
+    variation = 0  # depth of (...) variations
+    for line in lines:
+        line = line.strip()
+        if not comment and variation == 0 and line.startswith("["):
+            name, _, value = line[1:].rstrip("]").partition(" ")
+            yield ("tag", name, value.strip().strip('"'))
+            continue
+        if line.startswith("%"):  # escape line
+            continue
+        position = 0
+        while position < len(line):
+            if comment:
+                end = line.find("}", position)
+                if end < 0:
+                    break
+                comment = False
+                position = end + 1
+                continue
+            ch = line[position]
+            if ch == "{":
+                comment = True
+                position += 1
+            elif ch == ";":  # comment up to the end of the line
+                break
+            elif ch == "(":
+                variation += 1
+                position += 1
+            elif ch == ")":
+                variation = max(variation - 1, 0)
+                position += 1
+            elif ch.isspace():
+                position += 1
+            else:
+                end = position
+                while end < len(line) and not line[end].isspace() and line[end] not in "{};()":
+                    end += 1
+                token = line[position:end]
+                position = end
+                if variation:
+                    continue
+                if token in RESULTS:
+                    yield ("result", token)
+                elif token[0] == "$" or token.rstrip(".").isdigit():
+                    continue  # NAG or a bare move number
+                else:
+                    # "12.e4" / "12...e5" carry the number in the same token
+                    yield ("move", token.split(".")[-1] if "." in token else token)
+
+
+def readGames(lines):
+    """
+    Lazily parse PGN text (any iterable of lines, e.g. an open file) into
+    PGNGame objects, one game in memory at a time.
+    """
+    headers = {}
+    moves = []
+    for token in _tokens(lines):
+        if token[0] == "tag":
+            if moves:
+                # a game without a result token before the next tag section
+                yield PGNGame(headers, moves, headers.get("Result", "*"))
+                headers, moves = {}, []
+            headers[token[1]] = token[2]
+        elif token[0] == "move":
+            if token[1]:
+                moves.append(token[1])
+        else:
+            yield PGNGame(headers, moves, token[1])
+            headers, moves = {}, []
+    if headers or moves:
+        yield PGNGame(headers, moves, headers.get("Result", "*"))
+
+
+def readPGNFiles(paths):
+    """Every game of every file, in order"""
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            yield from readGames(f)
+
+
+# ---------- analysis (runs in the worker processes) ----------
+
+
+class _Deadline:
+    """Stop flag for SearchInfo that turns itself on after a number of seconds"""
+
+    def __init__(self, seconds):
+        self.end = time.perf_counter() + seconds
+
+    def is_set(self):
+        return time.perf_counter() >= self.end
+
+
+def _openStore(path):
+    """Pool initializer: every worker process opens its own connection"""
+    SmartMoveFinder.analysis_store = AnalysisStore.AnalysisStore(path)
+
+
+def _searchPosition(gs, validMoves, depth, timeLimit):
+    stopEvent = _Deadline(timeLimit) if timeLimit else None
+    info = SmartMoveFinder.SearchInfo(stopEvent)
+    SmartMoveFinder.stored_search(gs, validMoves, depth, info)
+    if info.bestMove is None:
+        # out of time before depth 1 was done: one ply is always affordable
+        info = SmartMoveFinder.SearchInfo()
+        SmartMoveFinder.searchIterative(gs, validMoves, 1, info)
+    return info
+
+
+def _sanLine(gs, pv):
+    """The PV in SAN, played out on gs and taken back again"""
+    line = []
+    for move in pv:
+        line.append(gs.getSAN(move))
+        gs.makeMove(move)
+    for move in pv:
+        gs.undoMove()
+    return line
+
+
+def analyseGame(task):
+    """
+    Replay one game and search every position before a move is played.
+    task is (index, headers, sanMoves, result, depth, timeLimit); returns a
+    dict ready for the writers, with "error" set if the game could not be
+    replayed (a bad FEN header, illegal or unsupported moves); positions up
+    to it are kept. Games with a FEN header start from that position, plies
+    are counted from the start of the game the FEN comes from.
+    """
+    index, headers, sanMoves, result, depth, timeLimit = task
+    gs = ChessEngine.GameState()
+    positions = []
+    error = None
+    startTime = time.perf_counter()
+    nodes = 0
+    if "FEN" in headers:
+        try:
+            gs.loadFEN(headers["FEN"])
+        except (ValueError, IndexError, KeyError) as e:
+            error = "FEN header: %s" % e
+            sanMoves = []
+    for ply, san in enumerate(sanMoves, gs.startPly):
+        validMoves = gs.getValidMoves()
+        try:
+            move = gs.parseSAN(san, validMoves)
+        except ValueError as e:
+            error = "ply %d: %s" % (ply + 1, e)
+            break
+        info = _searchPosition(gs, validMoves, depth, timeLimit)
+        nodes += info.nodes
+        positions.append(
+            {
+                "ply": ply + 1,
+                "move": gs.getSAN(move, validMoves),
+                "key": "%016x" % gs.zobristKey,
+                "depth": info.depth,
+                "score": round(info.bestScore, 2) + 0.0,  # positive is good for white, no -0.0
+                "best": gs.getSAN(info.bestMove, validMoves),
+                "pv": _sanLine(gs, info.pv),
+                "nodes": info.nodes,
+            }
+        )
+        gs.makeMove(move)
+    if SmartMoveFinder.analysis_store is not None:
+        # the pool may be terminated at any time after this result is sent
+        SmartMoveFinder.analysis_store.flush()
+    return {
+        "game": index,
+        "headers": headers,
+        "result": result,
+        "positions": positions,
+        "error": error,
+        "nodes": nodes,
+        "elapsed": round(time.perf_counter() - startTime, 3),
+    }
+
+
+# ---------- writing ----------
+
+
+def _evalComment(position):
+    score = position["score"]
+    if abs(score) >= SmartMoveFinder.CHECKMATE:
+        # a mate in n moves of the winning side
+        mateIn = (len(position["pv"]) + 1) // 2
+        evaluation = "#%d" % (mateIn if score > 0 else -mateIn)
+    else:
+        evaluation = "%.2f" % score
+    return "{[%%eval %s] [%%depth %d] best %s}" % (
+        evaluation,
+        position["depth"],
+        " ".join(position["pv"][:4]) or position["best"],
+    )
+
+
+def toJSONLine(analysis):
+    return json.dumps(analysis, separators=(",", ":")) + "\n"
+
+
+def toAnnotatedPGN(analysis):
+    lines = ['[%s "%s"]' % (name, value.replace('"', "'")) for name, value in analysis["headers"].items()]
+    if analysis["error"]:
+        lines.append('[Annotator "PGNPipeline: %s"]' % analysis["error"])
+    moveText = []
+    for position in analysis["positions"]:
+        ply = position["ply"]
+        if ply % 2 == 1:
+            moveText.append("%d." % ((ply + 1) // 2))
+        elif not moveText or moveText[-1].endswith("}"):
+            # after a comment, black's move gets its number again
+            moveText.append("%d..." % (ply // 2))
+        moveText.append(position["move"])
+        moveText.append(_evalComment(position))
+    moveText.append(analysis["result"])
+    # PGN export format: lines of at most 80 characters
+    wrapped = []
+    current = ""
+    for token in " ".join(moveText).split(" "):
+        if current and len(current) + 1 + len(token) > 79:
+            wrapped.append(current)
+            current = token
+        else:
+            current = current + " " + token if current else token
+    wrapped.append(current)
+    return "\n".join(lines) + "\n\n" + "\n".join(wrapped) + "\n\n"
+
+
+WRITERS = {"jsonl": toJSONLine, "pgn": toAnnotatedPGN}
+
+
+# ---------- the pipeline ----------
+
+
+def analyseGames(
+    games, depth=SmartMoveFinder.MAX_DEPTH, timeLimit=None, processes=None, pool=None, storePath=None
+):
+    """
+    Generator of analysis dicts, in the order of games (any iterable of
+    PGNGame, it is consumed lazily). At most GAMES_PER_WORKER games per
+    worker are submitted ahead of the one being waited for.
+    Pass a multiprocessing pool to reuse it, or one is created (with an
+    AnalysisStore at storePath in every worker, if given).
+    """
+    ownPool = pool is None
+    if ownPool:
+        if storePath is not None:
+            pool = multiprocessing.Pool(processes, _openStore, (storePath,))
+        else:
+            pool = multiprocessing.Pool(processes)
+    try:
+        # Pool.imap would read the whole archive ahead, so keep the window ourselves
+        window = GAMES_PER_WORKER * (processes or os.cpu_count() or 1)
+        pending = collections.deque()
+        for index, game in enumerate(games):
+            task = (index, game.headers, game.moves, game.result, depth, timeLimit)
+            pending.append(pool.apply_async(analyseGame, (task,)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        if ownPool:
+            pool.terminate()
+            pool.join()
+
+
+def runPipeline(
+    paths, output, fmt="jsonl", depth=SmartMoveFinder.MAX_DEPTH, timeLimit=None, processes=None, storePath=None
+):
+    """Analyse every game of the PGN files into output (a path), returns the game count"""
+    toText = WRITERS[fmt]
+    count = 0
+    buffer = []
+    startTime = time.perf_counter()
+    with open(output, "w", encoding="utf-8") as out:
+        for analysis in analyseGames(readPGNFiles(paths), depth, timeLimit, processes, None, storePath):
+            buffer.append(toText(analysis))
+            count += 1
+            if len(buffer) >= WRITE_BATCH:
+                out.writelines(buffer)
+                buffer.clear()
+                print(
+                    "%d games, %.1f s" % (count, time.perf_counter() - startTime),
+                    file=sys.stderr,
+                )
+        out.writelines(buffer)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse PGN archives with the engine")
+    parser.add_argument("pgn", nargs="+", help="PGN files, read in order")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl")
+    parser.add_argument("--depth", type=int, default=SmartMoveFinder.MAX_DEPTH)
+    parser.add_argument("--time", type=float, default=None, help="seconds per position (the depth still caps it)")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, default: CPU count")
+    parser.add_argument("--store", default=None, help="AnalysisStore database reused across runs")
+    args = parser.parse_args(argv)
+    startTime = time.perf_counter()
+    count = runPipeline(args.pgn, args.output, args.format, args.depth, args.time, args.processes, args.store)
+    print("%d games analysed in %.1f s" % (count, time.perf_counter() - startTime), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
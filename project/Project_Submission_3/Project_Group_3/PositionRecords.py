@@ -0,0 +1,328 @@
+"""
+Compact fixed-size position records for training data, and a multi-process
+generator that streams them from self-play and PGN archives to shard files.
+
+A record is 38 bytes (RECORD_DTYPE):
+    board   32 bytes  64 squares a8..h1, one nibble each (ChessEngine.pieceCodes)
+    flags   1 byte    bit 0: black to move, bits 1-4: CastleRights.index()
+    ep      1 byte    en passant file + 1, 0 if none
+    legal   1 byte    number of legal moves
+    score   int16     search score, centipawns, positive is good for white
+    result  1 byte    game result for white: 0 loss, 1 draw, 2 win, 3 unknown
+Pickling a GameState would also carry its moveLog of Move objects and the
+bound moveFunctions; a record holds just the position. Shards are plain
+concatenated records, so readers can np.memmap them (openShard).
+
+Usage:
+    python PositionRecords.py data/ --selfplay 200 --pgn games.pgn --shards 4 --depth 2
+"""
+import argparse
+import glob
+import math
+import multiprocessing
+import os
+import queue
+import random
+import struct
+import sys
+import time
+
+import numpy as np
+
+import ChessEngine
+import PGNPipeline
+import SmartMoveFinder
+
+RECORD = struct.Struct("<32sBBBhB")
+RECORD_DTYPE = np.dtype(
+    [("board", "u1", 32), ("flags", "u1"), ("ep", "u1"), ("legal", "u1"), ("score", "<i2"), ("result", "u1")]
+)
+assert RECORD.size == RECORD_DTYPE.itemsize == 38
+
+WHITE_WINS, DRAW, BLACK_WINS, UNKNOWN = 2, 1, 0, 3
+RESULT_CODES = {"1-0": WHITE_WINS, "1/2-1/2": DRAW, "0-1": BLACK_WINS}
+# mates and anything beyond are stored as +-MATE_SCORE centipawns
+MATE_SCORE = 32000
+# records kept in memory per shard before they are written out
+FLUSH_EVERY = 4096
+# generate() checks on its worker processes this often (seconds) while it waits
+POLL_SECONDS = 1.0
+
+
+# ---------- one record ----------
+
+
+def encode(gs, legalMoves, score=0.0, result=UNKNOWN):
+    """The record of gs: legalMoves its number of legal moves, score in pawns"""
+    board = gs.board
+    codes = ChessEngine.pieceCodes
+    packed = bytearray(32)
+    for r in range(8):
+        row = board[r]
+        for c in range(0, 8, 2):
+            packed[r * 4 + c // 2] = codes.get(row[c], 0) << 4 | codes.get(row[c + 1], 0)
+    flags = (0 if gs.whiteToMove else 1) | gs.currentCastlingRights.index() << 1
+    ep = gs.enpassantPossible[1] + 1 if gs.enpassantPossible != () else 0
+    centipawns = int(max(-MATE_SCORE, min(MATE_SCORE, round(score * 100))))
+    return RECORD.pack(bytes(packed), flags, ep, min(legalMoves, 255), centipawns, result)
+
+
+def decode(data):
+    """(gs, legal moves, score in pawns, result) of a record (bytes or a numpy record)"""
+    if isinstance(data, np.void):
+        data = data.tobytes()
+    packed, flags, ep, legal, centipawns, result = RECORD.unpack(data)
+    rows = []
+    for r in range(8):
+        row = ""
+        empty = 0
+        for c in range(8):
+            byte = packed[r * 4 + c // 2]
+            piece = ChessEngine.codePieces[byte >> 4 if c % 2 == 0 else byte & 15]
+            if piece == "--":
+                empty += 1
+                continue
+            if empty:
+                row += str(empty)
+                empty = 0
+            row += piece[1].upper() if piece[0] == "w" else piece[1].lower()
+        rows.append(row + str(empty) if empty else row)
+    whiteToMove = not flags & 1
+    rights = flags >> 1
+    castling = "".join(letter for bit, letter in ((1, "K"), (4, "Q"), (2, "k"), (8, "q")) if rights & bit)
+    # the square behind the pawn that just made a double step
+    enpassant = "-"
+    if ep:
+        enpassant = ChessEngine.Move.colsToFiles[ep - 1] + ("6" if whiteToMove else "3")
+    gs = ChessEngine.GameState()
+    gs.loadFEN("%s %s %s %s" % ("/".join(rows), "w" if whiteToMove else "b", castling or "-", enpassant))
+    return gs, legal, centipawns / 100, result
+
+
+# ---------- shards ----------
+
+
+def openShard(path):
+    """The records of a shard file, memory mapped (nothing read up front)"""
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode="r")
+
+
+def openShards(directory):
+    return [openShard(path) for path in sorted(glob.glob(os.path.join(directory, "shard-*.bin")))]
+
+
+def boards(records):
+    """(n, 64) piece codes a8..h1 of an array of records, vectorized"""
+    packed = records["board"]
+    squares = np.empty((len(packed), 64), dtype=np.uint8)
+    squares[:, 0::2] = packed >> 4
+    squares[:, 1::2] = packed & 15
+    return squares
+
+
+class ShardWriter:
+    """Appends records to one shard file, FLUSH_EVERY records at a time"""
+
+    def __init__(self, path):
+        self.file = open(path, "ab")
+        self.buffer = []
+        self.count = 0
+
+    def write(self, record):
+        self.buffer.append(record)
+        self.count += 1
+        if len(self.buffer) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        self.file.write(b"".join(self.buffer))
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+# ---------- generation (in the worker processes) ----------
+
+
+def _search(gs, validMoves, depth):
+    """(white positive score, best move) of gs: a search at depth, scoreBoard and no move at depth 0"""
+    if depth == 0:
+        return SmartMoveFinder.scoreBoard(gs), None
+    info = SmartMoveFinder.SearchInfo()
+    SmartMoveFinder.searchIterative(gs, validMoves, depth, info)
+    return info.bestScore, info.bestMove
+
+
+def _greedyMove(gs, validMoves):
+    """The move after which scoreBoard is best for the side to move"""
+    sign = 1 if gs.whiteToMove else -1
+    best, bestScore = validMoves[0], -math.inf
+    for move in validMoves:
+        gs.makeMove(move)
+        score = sign * SmartMoveFinder.scoreBoard(gs)
+        gs.undoMove()
+        if score > bestScore:
+            best, bestScore = move, score
+    return best
+
+
+def _withResult(records, result):
+    """The records of a game, now that its result is known"""
+    return [record[:-1] + bytes((result,)) for record in records]
+
+
+def selfPlayGame(seed, depth, randomPlies=8, maxPlies=200):
+    """
+    Records of one engine game: a few random opening plies for variety,
+    then the best move of a depth search every ply. Every ply is scored the
+    same way, by the depth search (scoreBoard at depth 0, where the moves
+    are picked by scoreBoard after them). Games reaching maxPlies (the
+    engine has no repetition / 50 move rule) are UNKNOWN.
+    """
+    rng = random.Random(seed)
+    gs = ChessEngine.GameState()
+    positions = []
+    result = UNKNOWN
+    for ply in range(maxPlies):
+        validMoves = gs.getValidMoves()
+        if not validMoves:
+            if gs.checkmate:
+                result = BLACK_WINS if gs.whiteToMove else WHITE_WINS
+            else:
+                result = DRAW
+            break
+        score, move = _search(gs, validMoves, depth)
+        if ply < randomPlies:
+            move = rng.choice(validMoves)
+        elif move is None:
+            move = _greedyMove(gs, validMoves) if depth == 0 else validMoves[0]
+        positions.append(encode(gs, len(validMoves), score))
+        gs.makeMove(move)
+    return _withResult(positions, result)
+
+
+def pgnGame(sanMoves, resultText, depth):
+    """Records of an archive game, scored by a search at depth"""
+    gs = ChessEngine.GameState()
+    positions = []
+    for san in sanMoves:
+        validMoves = gs.getValidMoves()
+        try:
+            move = gs.parseSAN(san, validMoves)
+        except ValueError:
+            break
+        positions.append(encode(gs, len(validMoves), _search(gs, validMoves, depth)[0]))
+        gs.makeMove(move)
+    return _withResult(positions, RESULT_CODES.get(resultText, UNKNOWN))
+
+
+def _worker(path, tasks, counts):
+    writer = ShardWriter(path)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            if task[0] == "selfplay":
+                records = selfPlayGame(task[1], task[2])
+            else:
+                records = pgnGame(task[1], task[2], task[3])
+            for record in records:
+                writer.write(record)
+    finally:
+        writer.close()
+        counts.put(writer.count)
+
+
+def _put(tasks, task, workers):
+    """tasks.put(task), raising instead of waiting forever once every worker is gone"""
+    while True:
+        try:
+            tasks.put(task, timeout=POLL_SECONDS)
+            return
+        except queue.Full:
+            if not any(worker.is_alive() for worker in workers):
+                raise RuntimeError("every record worker exited before all tasks were handed out")
+
+
+def _collectCounts(counts, workers):
+    """Sum of the record counts of the workers, raising if one exited without its count"""
+    total = 0
+    reported = 0
+    while reported < len(workers):
+        # checked before waiting: a worker puts its count before it exits,
+        # so once all have exited every count already sent can be read
+        finished = all(worker.exitcode is not None for worker in workers)
+        try:
+            total += counts.get(timeout=POLL_SECONDS)
+            reported += 1
+        except queue.Empty:
+            if finished:
+                raise RuntimeError(
+                    "%d of %d record workers exited without reporting (exit codes %s)"
+                    % (len(workers) - reported, len(workers), [worker.exitcode for worker in workers])
+                )
+    return total
+
+
+def generate(directory, selfPlayGames=0, pgnPaths=(), shards=None, depth=2, seed=0):
+    """
+    Write records of selfPlayGames engine games and every game of pgnPaths
+    to directory/shard-NNN.bin, one shard per worker process. Tasks go
+    through a bounded queue, so archives are read as the workers go.
+    Returns the number of records written; raises RuntimeError if a worker
+    process fails or dies.
+    """
+    os.makedirs(directory, exist_ok=True)
+    shards = shards or os.cpu_count() or 1
+    tasks = multiprocessing.Queue(maxsize=4 * shards)
+    counts = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=_worker, args=(os.path.join(directory, "shard-%03d.bin" % i), tasks, counts), daemon=True
+        )
+        for i in range(shards)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for game in range(selfPlayGames):
+            _put(tasks, ("selfplay", seed + game, depth), workers)
+        for game in PGNPipeline.readPGNFiles(pgnPaths):
+            _put(tasks, ("pgn", game.moves, game.result, depth), workers)
+        for worker in workers:
+            _put(tasks, None, workers)
+        total = _collectCounts(counts, workers)
+    except BaseException:
+        for worker in workers:
+            worker.terminate()
+        raise
+    for worker in workers:
+        worker.join()
+    # a worker that failed still reports what it wrote, but its game is lost
+    failed = [worker.exitcode for worker in workers if worker.exitcode != 0]
+    if failed:
+        raise RuntimeError("record workers failed with exit codes %s" % failed)
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate packed training positions")
+    parser.add_argument("directory", help="where the shard-NNN.bin files go (appended to)")
+    parser.add_argument("--selfplay", type=int, default=0, help="number of engine games")
+    parser.add_argument("--pgn", nargs="*", default=[], help="PGN archives")
+    parser.add_argument("--shards", type=int, default=None, help="worker processes / shard files")
+    parser.add_argument("--depth", type=int, default=2, help="search depth of the scores, 0: static eval")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    startTime = time.perf_counter()
+    total = generate(args.directory, args.selfplay, args.pgn, args.shards, args.depth, args.seed)
+    print("%d records in %.1f s" % (total, time.perf_counter() - startTime), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
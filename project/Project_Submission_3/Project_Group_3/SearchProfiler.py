@@ -0,0 +1,193 @@
+"""
+Instrumentation for SmartMoveFinder: where does the search spend its time?
+Collects nodes per ply, beta cutoffs by move index (how often the first
+move already cuts), hits of every cache and the cumulative time of each
+scoreBoard term, move generation and move ordering.
+
+Nothing is hooked while the profiler is disabled: the search only checks
+`SmartMoveFinder.profiler is not None` per node, and the timed functions
+are swapped in by enable() and put back by disable().
+
+Example:
+    with SearchProfiler.profiling() as prof:
+        SmartMoveFinder.findBestMoveMinMax(gs, gs.getValidMoves())
+    print(prof.toJSON())
+"""
+import contextlib
+import functools
+import json
+import time
+
+import ChessEngine
+import SmartMoveFinder
+
+# SmartMoveFinder functions timed one by one: the scoreBoard terms first,
+# then move ordering / generation helpers. Times are inclusive, e.g.
+# mobility_score includes the get_all_attacks calls it makes: the
+# getAllPossibleMoves of both sides on an attack_cache miss. It runs
+# before king_safety, is_in_check and tactical_score, so it pays for the
+# attack sets those terms then find in the cache.
+EVAL_TERMS = [
+    "scoreBoard",
+    "material_pst_score",
+    "bishop_pair_bonus",
+    "rooks_on_files_score",
+    "opening_phase_score",
+    "pawn_entry",
+    "find_king_positions_from_board",
+    "mobility_score",
+    "king_safety",
+    "is_in_check",
+    "tactical_score",
+]
+SEARCH_PARTS = ["get_move_priority", "see", "find_hash_move", "complete_pv"]
+# GameState methods timed as move generation
+ENGINE_METHODS = ["getValidMoves", "getAllPossibleMoves", "movedIntoCheck"]
+
+
+class SearchProfiler:
+    def __init__(self, onNode=None, onCutoff=None):
+        self.nodesPerPly = {}
+        self.cutoffsByMoveIndex = {}
+        self.cutoffsPerPly = {}
+        self.callTime = {}  # function name -> seconds
+        self.callCount = {}
+        # optional callbacks: onNode(ply), onCutoff(ply, moveIndex)
+        self.onNode = onNode
+        self.onCutoff = onCutoff
+        self.startTime = time.perf_counter()
+        # the tables count for the whole process, report only what we saw
+        self.baseline = self.cacheCounters()
+        self.final = None  # counters and elapsed time frozen by finish()
+
+    # ----- hooks called by the search -----
+
+    def node(self, ply):
+        self.nodesPerPly[ply] = self.nodesPerPly.get(ply, 0) + 1
+        if self.onNode is not None:
+            self.onNode(ply)
+
+    def cutoff(self, ply, moveIndex):
+        self.cutoffsByMoveIndex[moveIndex] = self.cutoffsByMoveIndex.get(moveIndex, 0) + 1
+        self.cutoffsPerPly[ply] = self.cutoffsPerPly.get(ply, 0) + 1
+        if self.onCutoff is not None:
+            self.onCutoff(ply, moveIndex)
+
+    def timed(self, name, function):
+        """function wrapped so its calls and cumulative time are recorded"""
+        callTime = self.callTime
+        callCount = self.callCount
+        callTime.setdefault(name, 0.0)
+        callCount.setdefault(name, 0)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                callTime[name] += time.perf_counter() - start
+                callCount[name] += 1
+
+        return wrapper
+
+    def finish(self):
+        """Freeze the cache counters and elapsed time, disable() calls it"""
+        self.final = (self.cacheCounters(), time.perf_counter() - self.startTime)
+
+    # ----- reporting -----
+
+    def firstMoveCutoffRate(self):
+        total = sum(self.cutoffsByMoveIndex.values())
+        return self.cutoffsByMoveIndex.get(0, 0) / total if total else 0.0
+
+    def cacheCounters(self):
+        tables = SmartMoveFinder.cache_tables()
+        if SmartMoveFinder.analysis_store is not None:
+            tables["analysis_store"] = SmartMoveFinder.analysis_store
+        counters = {name: (table.hits, table.misses) for name, table in tables.items()}
+        lazy = SmartMoveFinder.lazy_eval_stats
+        counters["lazy_eval"] = (lazy["lazy_exits"], lazy["evaluations"] - lazy["lazy_exits"])
+        return counters
+
+    def cacheStats(self):
+        stats = {}
+        counters = self.final[0] if self.final else self.cacheCounters()
+        for name, (hits, misses) in counters.items():
+            hits -= self.baseline.get(name, (0, 0))[0]
+            misses -= self.baseline.get(name, (0, 0))[1]
+            total = hits + misses
+            stats[name] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / total if total else 0.0,
+            }
+        # for lazy_eval a hit is an evaluation that could stop early
+        return stats
+
+    def toDict(self):
+        # JSON object keys have to be strings
+        return {
+            "elapsed": self.final[1] if self.final else time.perf_counter() - self.startTime,
+            "nodes": sum(self.nodesPerPly.values()),
+            "nodes_per_ply": {str(k): v for k, v in sorted(self.nodesPerPly.items())},
+            "cutoffs_per_ply": {str(k): v for k, v in sorted(self.cutoffsPerPly.items())},
+            "cutoffs_by_move_index": {
+                str(k): v for k, v in sorted(self.cutoffsByMoveIndex.items())
+            },
+            "first_move_cutoff_rate": self.firstMoveCutoffRate(),
+            "caches": self.cacheStats(),
+            "time": {
+                name: {"seconds": self.callTime[name], "calls": self.callCount[name]}
+                for name in sorted(self.callTime, key=self.callTime.get, reverse=True)
+            },
+        }
+
+    def toJSON(self, indent=2):
+        return json.dumps(self.toDict(), indent=indent)
+
+
+# the original functions, while the timed versions are installed
+_originals = {}
+
+
+def enable(onNode=None, onCutoff=None):
+    """Install a fresh SearchProfiler into the search and return it"""
+    disable()
+    prof = SearchProfiler(onNode, onCutoff)
+    for name in EVAL_TERMS + SEARCH_PARTS:
+        function = getattr(SmartMoveFinder, name)
+        _originals[(SmartMoveFinder, name)] = function
+        setattr(SmartMoveFinder, name, prof.timed(name, function))
+    for name in ENGINE_METHODS:
+        function = getattr(ChessEngine.GameState, name)
+        _originals[(ChessEngine.GameState, name)] = function
+        setattr(ChessEngine.GameState, name, prof.timed(name, function))
+    SmartMoveFinder.profiler = prof
+    return prof
+
+
+def disable():
+    """Take every hook out again, the search runs at full speed"""
+    if SmartMoveFinder.profiler is not None:
+        SmartMoveFinder.profiler.finish()
+    SmartMoveFinder.profiler = None
+    for (owner, name), function in _originals.items():
+        setattr(owner, name, function)
+    _originals.clear()
+
+
+@contextlib.contextmanager
+def profiling(onNode=None, onCutoff=None):
+    prof = enable(onNode, onCutoff)
+    try:
+        yield prof
+    finally:
+        disable()
+
+
+if __name__ == "__main__":
+    gs = ChessEngine.GameState()
+    with profiling() as prof:
+        SmartMoveFinder.findBestMoveMinMax(gs, gs.getValidMoves())
+    print(prof.toJSON())
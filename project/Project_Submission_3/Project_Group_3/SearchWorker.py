@@ -0,0 +1,168 @@
+"""
+A long-lived search process for the GUI. Starting a new Process for every
+AI move threw the transposition table away each time and left the CPU idle
+while the human was thinking. The worker stays alive for the whole game and,
+after answering, keeps searching (pondering) on the human's time:
+- if the search predicted the human's reply (the second move of the PV), it
+  already searches the position after that reply; when the human plays it
+  (a ponder hit) the answer is ready immediately
+- otherwise it searches the human's position, which fills the
+  transposition table with everything the next real search will need first
+On a ponder miss the GUI stops the ponder search and the real search starts
+with the warmed tables.
+"""
+import multiprocessing
+import queue
+import traceback
+
+import SmartMoveFinder
+
+
+class _StopFlag:
+    """
+    Stop flag for one request, handed to SearchInfo as its stopEvent.
+    Set once the GUI cancelled every request up to and including seq.
+    """
+
+    def __init__(self, cancelledUpTo, seq):
+        self.cancelledUpTo = cancelledUpTo
+        self.seq = seq
+
+    def is_set(self):
+        return self.cancelledUpTo.value >= self.seq
+
+
+class SearchResult:
+    """What the worker sends back for a search request"""
+
+    def __init__(self, seq, move, score, pv, ponderKey, ponderHit):
+        self.seq = seq
+        self.move = move
+        self.score = score  # positive is good for white, like scoreBoard
+        self.pv = pv
+        # gs.zobristKey the worker is pondering on now (None if not pondering)
+        self.ponderKey = ponderKey
+        self.ponderHit = ponderHit
+
+
+def _ponderMove(gs, result, pv):
+    """The reply we expect from the opponent after result was played"""
+    if len(pv) >= 2:
+        return pv[1]
+    gs.makeMove(result)
+    replies = gs.getValidMoves()
+    expected = SmartMoveFinder.transposition_table.bestMove(gs, replies)
+    gs.undoMove()
+    return expected
+
+
+def workerLoop(commands, results, cancelledUpTo, ponder):
+    """Body of the worker process: answer search requests, ponder in between"""
+    # (zobristKey, SearchInfo) of the last finished ponder search
+    pondered = None
+    while True:
+        command = commands.get()
+        if command is None:
+            return
+        seq, gs, validMoves = command
+        stopFlag = _StopFlag(cancelledUpTo, seq)
+        if stopFlag.is_set():
+            continue  # cancelled before we even got to it
+
+        try:
+            if pondered is not None and pondered[0] == gs.zobristKey and pondered[1].bestMove:
+                info = pondered[1]
+                ponderHit = True
+            else:
+                info = SmartMoveFinder.SearchInfo(stopFlag)
+                SmartMoveFinder.findBestMoveMinMax(gs, validMoves, None, info)
+                ponderHit = False
+            pondered = None
+            move = info.bestMove if info.bestMove else (validMoves[0] if validMoves else None)
+        except Exception:
+            traceback.print_exc()
+            results.put(SearchResult(seq, None, 0, [], None, False))
+            continue
+
+        ponderKey = None
+        ponderGs = None
+        if ponder and move is not None and not stopFlag.is_set():
+            expected = _ponderMove(gs, move, info.pv)
+            gs.makeMove(move)
+            if expected is not None:
+                gs.makeMove(expected)
+                ponderKey = gs.zobristKey
+            ponderGs = gs
+        results.put(SearchResult(seq, move, info.bestScore, info.pv, ponderKey, ponderHit))
+
+        if ponderGs is not None:
+            # think on the opponent's time, until the GUI cancels this seq
+            ponderInfo = SmartMoveFinder.SearchInfo(stopFlag)
+            try:
+                ponderMoves = ponderGs.getValidMoves()
+                if ponderMoves:
+                    SmartMoveFinder.searchIterative(
+                        ponderGs, ponderMoves, SmartMoveFinder.MAX_DEPTH, ponderInfo
+                    )
+            except Exception:
+                traceback.print_exc()
+            # only a complete search is good enough to answer a ponder hit
+            if ponderKey is not None and not stopFlag.is_set():
+                pondered = (ponderKey, ponderInfo)
+
+
+class SearchWorker:
+    """
+    GUI side handle of the worker process.
+    search() sends a request, poll() returns its SearchResult once ready,
+    stop() abandons whatever the worker is doing (search or ponder).
+    """
+
+    def __init__(self, ponder=True):
+        self.commands = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        # every request up to this seq is cancelled; read on every search node
+        # so it's a raw shared int without a lock
+        self.cancelledUpTo = multiprocessing.RawValue("q", 0)
+        self.seq = 0
+        self.ponderKey = None
+        self.process = multiprocessing.Process(
+            target=workerLoop,
+            args=(self.commands, self.results, self.cancelledUpTo, ponder),
+            daemon=True,
+        )
+        self.process.start()
+
+    def search(self, gs, validMoves):
+        """Ask for the best move in gs, collect it later with poll()"""
+        if gs.zobristKey != self.ponderKey:
+            # ponder miss (or no ponder): the worker must drop what it's doing
+            self.stop()
+        # on a ponder hit the ponder search keeps running and answers this
+        self.ponderKey = None
+        self.seq += 1
+        self.commands.put((self.seq, gs, validMoves))
+
+    def poll(self):
+        """The SearchResult of the latest request, or None if not ready yet"""
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                return None
+            # results of cancelled requests are simply dropped
+            if result.seq == self.seq and self.cancelledUpTo.value < result.seq:
+                self.ponderKey = result.ponderKey
+                return result
+
+    def stop(self):
+        """Cancel every request sent so far, including its pondering"""
+        self.cancelledUpTo.value = self.seq
+        self.ponderKey = None
+
+    def close(self):
+        self.stop()
+        self.commands.put(None)
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
@@ -0,0 +1,337 @@
+"""
+Many concurrent games in one process. A GameState per game is heavy: 64
+strings in 8 lists, a Move object per ply, the castling / en passant /
+Zobrist logs and a dict of bound methods. A CompactGame keeps only:
+    board   32 bytes, two squares a byte (ChessEngine.pieceCodes)
+    state   bit 0: black to move, bits 1-4: CastleRights.index(),
+            bits 5-8: en passant file + 1, 0 if none
+    moves   the moveIDs played, an array of 2 byte ints
+    start   (board, state, ply) the moves start from, one shared tuple for
+            every game from the standard start
+The host turns a game back into a GameState only while it works on it, in
+one scratch GameState it reuses for every game; the Zobrist keys and
+evaluation tables are module level and shared by all games anyway.
+Searches are sent, as packed positions, to one multiprocessing pool shared
+by all games, whose workers keep their transposition tables between calls.
+
+Example:
+    with SessionHost.SessionHost(processes=4, cacheBudget="64 MB") as host:
+        game = host.newGame()
+        host.applyMove(game, "e4")
+        moveID, score, pv = host.search(game, depth=3).get()
+        host.applyMove(game, moveID)
+
+python SessionHost.py compares the memory of a CompactGame and a GameState.
+"""
+import argparse
+import array
+import multiprocessing
+import random
+import sys
+import time
+import tracemalloc
+
+import ChessEngine
+import SmartMoveFinder
+
+_codes = dict(ChessEngine.pieceCodes, **{"--": 0})
+# the two squares of a packed byte
+_byteSquares = {
+    high << 4 | low: (highPiece, lowPiece)
+    for high, highPiece in ChessEngine.codePieces.items()
+    for low, lowPiece in ChessEngine.codePieces.items()
+}
+
+
+def packPosition(gs):
+    """(board bytes, state) of the position of gs"""
+    packed = bytearray(32)
+    for r, row in enumerate(gs.board):
+        for c in range(0, 8, 2):
+            packed[r * 4 + c // 2] = _codes[row[c]] << 4 | _codes[row[c + 1]]
+    state = (0 if gs.whiteToMove else 1) | gs.currentCastlingRights.index() << 1
+    if gs.enpassantPossible != ():
+        state |= (gs.enpassantPossible[1] + 1) << 5
+    return bytes(packed), state
+
+
+def unpackPosition(board, state, gs, startPly=0):
+    """Set gs to a packed position, its move log starts empty"""
+    rows = []
+    for r in range(8):
+        row = []
+        for i in range(r * 4, r * 4 + 4):
+            row.extend(_byteSquares[board[i]])
+        rows.append(row)
+    whiteToMove = not state & 1
+    rights = state >> 1 & 15
+    epFile = state >> 5
+    # the square behind the pawn that just made a double step
+    enpassant = (2 if whiteToMove else 5, epFile - 1) if epFile else ()
+    gs.loadPosition(
+        rows,
+        whiteToMove,
+        ChessEngine.CastleRights(bool(rights & 1), bool(rights & 2), bool(rights & 4), bool(rights & 8)),
+        enpassant,
+        startPly,
+    )
+
+
+START = packPosition(ChessEngine.GameState()) + (0,)
+
+
+class CompactGame:
+    __slots__ = ("board", "state", "moves", "start", "result")
+
+    def __init__(self, start=START):
+        self.board, self.state = start[0], start[1]
+        self.moves = array.array("H")
+        self.start = start
+        # "1-0", "0-1" or "1/2-1/2" once the side to move has no legal move
+        self.result = None
+
+
+def gameBytes(game):
+    """Memory held by one CompactGame, the shared standard start not counted"""
+    size = sys.getsizeof(game) + sys.getsizeof(game.board) + sys.getsizeof(game.state) + sys.getsizeof(game.moves)
+    if game.start is not START:
+        size += sys.getsizeof(game.start) + sys.getsizeof(game.start[0]) + sys.getsizeof(game.start[1])
+    return size
+
+
+# ---------- search (in the pool's worker processes) ----------
+
+# every worker unpacks its positions into the same GameState
+_workerState = None
+
+
+def _searchTask(task):
+    """(best moveID, score, PV moveIDs) of a packed position, moveID None if the game is over"""
+    global _workerState
+    board, state, depth = task
+    if _workerState is None:
+        _workerState = ChessEngine.GameState()
+    gs = _workerState
+    unpackPosition(board, state, gs)
+    validMoves = gs.getValidMoves()
+    if not validMoves:
+        return None, SmartMoveFinder.scoreBoard(gs), []
+    info = SmartMoveFinder.SearchInfo()
+    SmartMoveFinder.stored_search(gs, validMoves, depth, info)
+    move = info.bestMove or validMoves[0]
+    return move.moveID, info.bestScore, [m.moveID for m in info.pv]
+
+
+class SessionHost:
+    """
+    The games of a server process, by game id. Every call takes a game id;
+    moves can be given as a Move, a moveID or a SAN string. Illegal moves
+    and moves in finished games raise ValueError.
+    """
+
+    def __init__(self, processes=None, pool=None, cacheBudget=None):
+        self.games = {}
+        self.nextId = 0
+        self.scratch = ChessEngine.GameState()
+        # (game id, ply) of the position in scratch, and its legal moves once generated
+        self.loaded = None
+        self.legal = None
+        self.processes = processes
+        self.pool = pool
+        self.ownPool = pool is None
+        # memory of each worker's search tables, e.g. "64 MB" (None: the default)
+        self.cacheBudget = cacheBudget
+
+    def newGame(self, fen=None):
+        """Start a game (from the standard start or a FEN), returns its id"""
+        start = START
+        if fen is not None:
+            self.scratch.loadFEN(fen)
+            start = packPosition(self.scratch) + (self.scratch.startPly,)
+        gameId = self.nextId
+        self.nextId += 1
+        self.games[gameId] = CompactGame(start)
+        self.loaded = None
+        return gameId
+
+    def endGame(self, gameId):
+        del self.games[gameId]
+        if self.loaded is not None and self.loaded[0] == gameId:
+            self.loaded = None
+
+    def _load(self, gameId):
+        """The game, with its current position in self.scratch"""
+        game = self.games[gameId]
+        ply = len(game.moves)
+        if self.loaded != (gameId, ply):
+            unpackPosition(game.board, game.state, self.scratch, game.start[2] + ply)
+            self.loaded = (gameId, ply)
+            self.legal = None
+        return game
+
+    def legalMoves(self, gameId):
+        """Legal moves of the game (Move objects, valid until the next call)"""
+        game = self._load(gameId)
+        if self.legal is None:
+            self.legal = self.scratch.getValidMoves()
+            if not self.legal:
+                if self.scratch.checkmate:
+                    game.result = "0-1" if self.scratch.whiteToMove else "1-0"
+                else:
+                    game.result = "1/2-1/2"
+        return self.legal
+
+    def applyMove(self, gameId, move):
+        """Play move in the game, returns the Move played"""
+        legal = self.legalMoves(gameId)
+        game = self.games[gameId]
+        if game.result is not None:
+            raise ValueError("game %d is over (%s)" % (gameId, game.result))
+        if isinstance(move, str):
+            played = self.scratch.parseSAN(move, legal)
+        else:
+            moveID = move if isinstance(move, int) else move.moveID
+            played = next((m for m in legal if m.moveID == moveID), None)
+            if played is None:
+                raise ValueError("illegal move %s in game %d" % (move, gameId))
+        self.scratch.makeMove(played)
+        game.moves.append(played.moveID)
+        game.board, game.state = packPosition(self.scratch)
+        self.loaded = (gameId, len(game.moves))
+        self.legal = None
+        return played
+
+    def undoMove(self, gameId):
+        """Take back the last move of the game"""
+        game = self.games[gameId]
+        if not game.moves:
+            return
+        ply = len(game.moves)
+        if self.loaded == (gameId, ply) and self.scratch.moveLog:
+            self.scratch.undoMove()
+        else:
+            # replay from the start, the compact game has no undo information
+            unpackPosition(game.start[0], game.start[1], self.scratch, game.start[2])
+            for moveID in game.moves[:-1]:
+                self.scratch.makeMove(next(m for m in self.scratch.getValidMoves() if m.moveID == moveID))
+        game.moves.pop()
+        game.board, game.state = packPosition(self.scratch)
+        game.result = None
+        self.loaded = (gameId, ply - 1)
+        self.legal = None
+
+    def fen(self, gameId):
+        self._load(gameId)
+        return self.scratch.getFEN()
+
+    def result(self, gameId):
+        """None while the game goes on, else "1-0", "0-1" or "1/2-1/2" """
+        self.legalMoves(gameId)
+        return self.games[gameId].result
+
+    # ----- searches -----
+
+    def getPool(self):
+        if self.pool is None:
+            if self.cacheBudget is not None:
+                self.pool = multiprocessing.Pool(self.processes, SmartMoveFinder.set_cache_budget, (self.cacheBudget,))
+            else:
+                self.pool = multiprocessing.Pool(self.processes)
+        return self.pool
+
+    def search(self, gameId, depth=SmartMoveFinder.MAX_DEPTH):
+        """
+        Search the game's position in the pool. Returns the AsyncResult;
+        get() gives (best moveID, score, PV moveIDs), score positive is good
+        for white like scoreBoard.
+        """
+        game = self.games[gameId]
+        return self.getPool().apply_async(_searchTask, ((game.board, game.state, depth),))
+
+    def searchAll(self, gameIds, depth=SmartMoveFinder.MAX_DEPTH):
+        """Search several games at once, returns {game id: (moveID, score, pv)}"""
+        pending = {gameId: self.search(gameId, depth) for gameId in gameIds}
+        return {gameId: result.get() for gameId, result in pending.items()}
+
+    def memoryUsage(self):
+        """Bytes held by all the games"""
+        return sum(gameBytes(game) for game in self.games.values())
+
+    def close(self):
+        if self.ownPool and self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------- memory measurement ----------
+
+
+def randomGames(games, plies, seed=0):
+    """moveID lists of random games of up to plies plies"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(games):
+        gs = ChessEngine.GameState()
+        line = []
+        for ply in range(plies):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            move = rng.choice(moves)
+            gs.makeMove(move)
+            line.append(move.moveID)
+        lines.append(line)
+    return lines
+
+
+def gameStateBytes(line):
+    """Memory a GameState holds after playing the moveIDs of line (traced)"""
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    gs = ChessEngine.GameState()
+    for moveID in line:
+        gs.makeMove(next(m for m in gs.getValidMoves() if m.moveID == moveID))
+    size = tracemalloc.get_traced_memory()[0] - before
+    if not tracing:
+        tracemalloc.stop()
+    del gs
+    return size
+
+
+def memoryPerGame(games=50, plies=40, seed=0):
+    """Average bytes a game takes as a GameState and as a CompactGame"""
+    lines = randomGames(games, plies, seed)
+    host = SessionHost()
+    for line in lines:
+        gameId = host.newGame()
+        for moveID in line:
+            host.applyMove(gameId, moveID)
+    return {
+        "GameState": sum(gameStateBytes(line) for line in lines) / games,
+        "CompactGame": host.memoryUsage() / games,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory of a hosted game against a GameState")
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--plies", type=int, default=40)
+    args = parser.parse_args(argv)
+    startTime = time.perf_counter()
+    sizes = memoryPerGame(args.games, args.plies)
+    for name, size in sizes.items():
+        print("%-12s %8.0f bytes per game" % (name, size))
+    print("%.1fx smaller, measured in %.1f s" % (sizes["GameState"] / sizes["CompactGame"], time.perf_counter() - startTime))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,25 @@
 
 import random
 import math
-import traceback
-import time
+from collections import OrderedDict
 
 CHECKMATE = 1000
 STALEMATE = 0
 MAX_DEPTH = 3  # change for strength / speed
+# Aspiration windows: from the second iteration on, the root starts with a
+# narrow window around the previous score instead of -CHECKMATE..CHECKMATE.
+# A fail low / high widens the failed side and searches the depth again.
+ASPIRATION_WINDOW = 0.5  # initial half width in pawns, 0 disables it
+ASPIRATION_GROWTH = 2.0  # the width is multiplied by this after each fail
+ASPIRATION_MAX_RESEARCHES = 3  # then give up and use the full window
+# Lazy evaluation: scoreBoard stops after the cheap terms when they are this
+# far (in pawns) outside the search window; 0 turns it off
+LAZY_EVAL_MARGIN = 3.0
 nextMove = None
-nodesExplored = 0  # Global counter for nodes explored
+# set by SearchProfiler.enable(), the search only reports to it when not None
+profiler = None
+# an AnalysisStore.AnalysisStore: results kept on disk across runs (None: off)
+analysis_store = None
 
 # ---------- Piece values ----------
 pieceScore = {"K": 0, "Q": 10, "R": 5, "B": 3, "N": 3, "p": 1}
@@ -95,49 +106,313 @@ piecePositionScores = {
     "bp": pawnScores,
 }
 
+# ---------- Term weights (pawns, a bonus for the side that has it) ----------
+# TexelTuner.py fits these together with pieceScore and the tables above
+evalWeights = {
+    "bishop_pair": 0.5,
+    "rook_semi_open": 0.25,
+    "rook_open": 0.35,  # on top of the semi-open bonus
+    # opening principles
+    "development": 0.5,  # per developed minor piece
+    "center_pawn": 0.3,
+    "early_queen_undeveloped": -2.5,
+    "early_queen_one_developed": -2.0,
+    "early_queen_under_three": -1.5,
+    "early_queen_center_closed": -1.0,
+    "queen_before_castling": -0.8,
+    "castled": 1.5,
+    "castled_developed": 0.6,
+    "castle_ready": 0.5,  # developed, queen home, not castled yet
+}
+
 # ---------- Caching and Optimization ----------
-class EvaluationCache:
-    def __init__(self, max_size=1000):
-        self.cache = {}
+class BoundedTable:
+    """
+    A dict with a maximum number of entries and hit / miss counters, the
+    common part of the engine caches. A full table drops its oldest entry
+    on put(); an OrderedDict does that in O(1), popping the first key of a
+    plain dict gets slower the more entries were deleted before it.
+    entry_bytes is the average memory of an entry (key, value and the
+    table's own share, measured with tracemalloc), set_cache_budget sizes
+    the tables with it.
+    """
+    entry_bytes = 200
+
+    def __init__(self, max_size):
+        self.table = OrderedDict()
         self.max_size = max_size
-        self.access_count = {}
-        
-    def get_key(self, board, white_to_move):
-        # Create a simple hash of the board state
-        key_parts = []
-        for r in range(8):
-            for c in range(8):
-                key_parts.append(board[r][c])
-        key_parts.append(str(white_to_move))
-        return ''.join(key_parts)
-    
+        self.hits = 0
+        self.misses = 0
+
     def get(self, key):
-        if key in self.cache:
-            self.access_count[key] = self.access_count.get(key, 0) + 1
-            return self.cache[key]
-        return None
-    
+        entry = self.table.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
     def put(self, key, value):
-        if len(self.cache) >= self.max_size:
-            # Remove least frequently used
-            least_used = min(self.access_count.items(), key=lambda x: x[1])
-            del self.cache[least_used[0]]
-            del self.access_count[least_used[0]]
-        self.cache[key] = value
-        self.access_count[key] = 1
+        if key not in self.table and len(self.table) >= self.max_size:
+            self.table.popitem(last=False)
+        self.table[key] = value
+
+    def resize(self, max_size):
+        """Change the capacity, dropping the oldest entries that no longer fit"""
+        self.max_size = max(1, max_size)
+        while len(self.table) > self.max_size:
+            self.table.popitem(last=False)
+
+    def clear(self):
+        self.table.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "entries": len(self.table),
+            "capacity": self.max_size,
+            "occupancy": len(self.table) / self.max_size,
+            "bytes": len(self.table) * self.entry_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+        }
+
+
+class EvaluationCache(BoundedTable):
+    """scoreBoard results keyed by gs.zobristKey"""
+    entry_bytes = 170
+
+    def __init__(self, max_size=1000):
+        super().__init__(max_size)
 
 eval_cache = EvaluationCache()
 
+# how often scoreBoard got past the cache and how often it could stop early
+lazy_eval_stats = {"evaluations": 0, "lazy_exits": 0}
+
+# bound types stored with a transposition table score
+EXACT = 0
+LOWERBOUND = 1  # the real score is at least this (a beta cutoff happened)
+UPPERBOUND = 2  # the real score is at most this (nothing beat alpha)
+
+class TranspositionTable(BoundedTable):
+    """
+    Search results keyed by gs.zobristKey: (depth, score, bound, bestMoveID).
+    It outlives a single search, so a long-lived worker (and pondering)
+    keeps finding what earlier searches already worked out.
+    """
+    entry_bytes = 240
+
+    def __init__(self, max_size=200000):
+        super().__init__(max_size)
+
+    def put(self, key, depth, score, bound, bestMoveID):
+        old = self.table.get(key)
+        # keep the deeper result of the same position
+        if old is not None and old[0] > depth:
+            return
+        super().put(key, (depth, score, bound, bestMoveID))
+
+    def bestMove(self, gs, validMoves):
+        """The stored best move for gs if it is one of validMoves"""
+        entry = self.table.get(gs.zobristKey)
+        if entry is not None:
+            for move in validMoves:
+                if move.moveID == entry[3]:
+                    return move
+        return None
+
+transposition_table = TranspositionTable()
+
+class PawnHashTable(BoundedTable):
+    """
+    Pawn structure results keyed by gs.pawnKey, the hash of the pawns alone.
+    Pawns move far less often than everything else, so most leaves find
+    their pawn structure here. An entry is a PawnEntry.
+    """
+    entry_bytes = 740
+
+    def __init__(self, max_size=20000):
+        super().__init__(max_size)
+
+pawn_table = PawnHashTable()
+
+class AttackCache(BoundedTable):
+    """
+    Attacked squares (get_all_attacks) keyed by (gs.zobristKey, side).
+    One evaluation asks for the same attack sets several times.
+    """
+    entry_bytes = 3600
+
+    def __init__(self, max_size=1000):
+        super().__init__(max_size)
+
+attack_cache = AttackCache()
+
+# ---------- Memory budget ----------
+# One budget for all the tables above, split by CACHE_SHARES. Engines
+# sharing a machine (SessionHost workers) call set_cache_budget to cap
+# their memory.
+CACHE_BUDGET = "64 MB"
+CACHE_SHARES = {
+    "transposition_table": 0.65,
+    "eval_cache": 0.15,
+    "pawn_table": 0.15,
+    "attack_cache": 0.05,
+}
+_size_units = {"": 1, "B": 1, "KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+
+def parse_size(size):
+    """Bytes of a size like 256 MB, "64MB", "1GB" or a plain number of bytes"""
+    if isinstance(size, (int, float)):
+        return int(size)
+    text = size.strip().upper()
+    number = text.rstrip("KMGB ")
+    unit = text[len(number):].strip()
+    if unit not in _size_units:
+        raise ValueError("not a size: %s" % size)
+    try:
+        return int(float(number) * _size_units[unit])
+    except ValueError:
+        raise ValueError("not a size: %s" % size)
+
+def cache_tables():
+    return {
+        "transposition_table": transposition_table,
+        "eval_cache": eval_cache,
+        "pawn_table": pawn_table,
+        "attack_cache": attack_cache,
+    }
+
+def set_cache_budget(size, shares=None):
+    """
+    Resize every table to its share of size (bytes or a string like
+    "256 MB"). Returns {table name: capacity in entries}.
+    """
+    budget = parse_size(size)
+    shares = shares or CACHE_SHARES
+    total = sum(shares.values())
+    capacities = {}
+    for name, table in cache_tables().items():
+        table.resize(int(budget * shares.get(name, 0) / total / table.entry_bytes))
+        capacities[name] = table.max_size
+    return capacities
+
+def clear_caches():
+    for table in cache_tables().values():
+        table.clear()
+
+def cache_report():
+    """{table name: entries, capacity, occupancy, bytes, hits, misses, hit_rate}"""
+    return {name: table.stats() for name, table in cache_tables().items()}
+
+set_cache_budget(CACHE_BUDGET)
+
+# ---------- Static Exchange Evaluation ----------
+# pieceScore values the king at 0, but in an exchange it is the piece you
+# use last, and capturing it ends the exchange
+seeScore = dict(pieceScore, K=100)
+
+knightJumps = ((-1, -2), (-1, 2), (-2, -1), (-2, 1), (1, -2), (1, 2), (2, -1), (2, 1))
+kingSteps = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+diagonals = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+orthogonals = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+def square_attackers(board, row, col, color):
+    """All (value, r, c) pieces of color attacking (row, col), sliders included"""
+    attackers = []
+    # a white pawn attacks from the row below (higher index), a black one from above
+    pawnRow = row + 1 if color == "w" else row - 1
+    if 0 <= pawnRow < 8:
+        for c in (col - 1, col + 1):
+            if 0 <= c < 8 and board[pawnRow][c] == color + "p":
+                attackers.append((seeScore["p"], pawnRow, c))
+    for dr, dc in knightJumps:
+        r, c = row + dr, col + dc
+        if 0 <= r < 8 and 0 <= c < 8 and board[r][c] == color + "N":
+            attackers.append((seeScore["N"], r, c))
+    for dr, dc in kingSteps:
+        r, c = row + dr, col + dc
+        if 0 <= r < 8 and 0 <= c < 8 and board[r][c] == color + "K":
+            attackers.append((seeScore["K"], r, c))
+    for directions, slider in ((diagonals, "B"), (orthogonals, "R")):
+        for dr, dc in directions:
+            r, c = row + dr, col + dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                piece = board[r][c]
+                if piece != "--":
+                    # only the first piece on the ray, anything behind it is
+                    # found again once this one has captured (x-rays)
+                    if piece[0] == color and piece[1] in (slider, "Q"):
+                        attackers.append((seeScore[piece[1]], r, c))
+                    break
+                r += dr
+                c += dc
+    return attackers
+
+def see(gs, move):
+    """
+    Static exchange evaluation: the material (in pieceScore units) the
+    moving side wins on move.end square when both sides keep recapturing
+    with their least valuable attacker, each free to stop when that's better.
+    Negative means the capture loses material.
+    """
+    board = [row[:] for row in gs.board]
+    row, col = move.endRow, move.endCol
+    gain = [seeScore[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0]
+    onSquare = move.pieceMoved
+    board[move.startRow][move.startCol] = "--"
+    if move.isEnpassantMove:
+        board[move.startRow][move.endCol] = "--"
+    if move.isPawnPromotion:
+        onSquare = onSquare[0] + "Q"
+        gain[0] += seeScore["Q"] - seeScore["p"]
+    board[row][col] = onSquare
+    color = "b" if move.pieceMoved[0] == "w" else "w"
+    while onSquare[1] != "K":
+        attackers = square_attackers(board, row, col, color)
+        if not attackers:
+            break
+        value, r, c = min(attackers)
+        if value == seeScore["K"]:
+            # the king may only take a piece the other side can't take back
+            board[r][c] = "--"
+            defended = square_attackers(board, row, col, "b" if color == "w" else "w")
+            board[r][c] = color + "K"
+            if defended:
+                break
+        # speculative: what the side capturing now would have if it stops next
+        gain.append(seeScore[onSquare[1]] - gain[-1])
+        onSquare = board[r][c]
+        board[r][c] = "--"
+        board[row][col] = onSquare
+        color = "b" if color == "w" else "w"
+    # walk the swap list back, each side picks the better of stop / go on
+    for d in range(len(gain) - 1, 0, -1):
+        gain[d - 1] = -max(-gain[d - 1], gain[d])
+    return gain[0]
+
 # ---------- Move Ordering Heuristics ----------
 def get_move_priority(move, gs, is_white):
     """Assign priority to moves for better alpha-beta pruning"""
     priority = 0
     
-    # Captures get highest priority
+    # Winning and even captures get highest priority, losing ones go behind
+    # the quiet moves (even if they give check)
     if move.pieceCaptured != "--":
-        captured_value = pieceScore.get(move.pieceCaptured[1], 0)
-        attacker_value = pieceScore.get(move.pieceMoved[1], 0)
-        priority += 1000 + (captured_value * 10 - attacker_value)
+        exchange = see(gs, move)
+        if exchange >= 0:
+            captured_value = pieceScore.get(move.pieceCaptured[1], 0)
+            attacker_value = pieceScore.get(move.pieceMoved[1], 0)
+            priority += 1000 + exchange * 10 + (captured_value * 10 - attacker_value)
+        else:
+            priority -= 3000
     
     # Promotions are very good
     if move.isPawnPromotion:
@@ -169,6 +444,85 @@ def get_move_priority(move, gs, is_white):
     
     return priority
 
+def capture_priority(move):
+    """MVV-LVA: most valuable victim first, cheapest attacker first"""
+    captured_value = pieceScore.get(move.pieceCaptured[1], 0) if move.isCapture else 0
+    attacker_value = pieceScore.get(move.pieceMoved[1], 0)
+    promotion = pieceScore["Q"] if move.isPawnPromotion else 0
+    return (captured_value + promotion) * 10 - attacker_value
+
+def find_hash_move(gs, hashMoveID):
+    """
+    The move with id hashMoveID if it is pseudo-legal here. Only the moves of
+    the piece on its start square get generated, not the whole move list.
+    """
+    startRow, startCol = hashMoveID // 1000, hashMoveID // 100 % 10
+    endRow, endCol = hashMoveID // 10 % 10, hashMoveID % 10
+    piece = gs.board[startRow][startCol]
+    if piece == "--" or (piece[0] == "w") != gs.whiteToMove:
+        return None
+    moves = []
+    if piece[1] == "K" and abs(endCol - startCol) == 2:
+        gs.getCastleMoves(startRow, startCol, moves)
+    else:
+        gs.moveFunctions[piece[1]](startRow, startCol, moves)
+    for move in moves:
+        if move.moveID == hashMoveID:
+            return move
+    return None
+
+def generate_staged_moves(gs, hashMoveID, ply):
+    """
+    Pseudo-legal moves for the side to move, generated lazily in stages:
+    the hash move, then winning and even captures and promotions (by SEE,
+    best victim first), then quiet moves and castling, and last the captures
+    that lose material. Legality is left to the caller, who only checks the
+    moves it actually searches, so a beta cutoff early on skips generating
+    and legality-testing the rest of the list.
+    """
+    hashMove = None
+    if hashMoveID is not None:
+        hashMove = find_hash_move(gs, hashMoveID)
+        if hashMove is not None:
+            yield hashMove
+
+    captures = []
+    quiets = []
+    for move in gs.getAllPossibleMoves():
+        if hashMove is not None and move.moveID == hashMove.moveID:
+            continue
+        if move.isCapture or move.isPawnPromotion:
+            captures.append(move)
+        else:
+            quiets.append(move)
+    goodCaptures = []
+    badCaptures = []
+    for move in captures:
+        exchange = see(gs, move)
+        if exchange >= 0:
+            goodCaptures.append((exchange, capture_priority(move), move))
+        else:
+            badCaptures.append((exchange, capture_priority(move), move))
+    goodCaptures.sort(key=lambda x: x[:2], reverse=True)
+    for _, _, move in goodCaptures:
+        yield move
+
+    # castle moves are only generated now, they need attack tests
+    kingRow, kingCol = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+    castles = []
+    gs.getCastleMoves(kingRow, kingCol, castles)
+    for move in castles:
+        if hashMove is None or move.moveID != hashMove.moveID:
+            quiets.append(move)
+    # near the root the expensive ordering still pays for itself
+    if ply <= 1:
+        quiets.sort(key=lambda m: get_move_priority(m, gs, gs.whiteToMove), reverse=True)
+    yield from quiets
+
+    badCaptures.sort(key=lambda x: x[:2], reverse=True)
+    for _, _, move in badCaptures:
+        yield move
+
 # ---------- Helpers ----------
 def flip_board_index_for_black(row, col):
     return 7 - row, col
@@ -191,6 +545,65 @@ def get_pst_value(square, row, col):
             r, c = flip_board_index_for_black(row, col)
             return table[r][c]
 
+# ---------- Precomputed material + PST ----------
+def build_square_scores():
+    """
+    Signed (white positive) material + PST value of every piece on every
+    square, e.g. squareScores["bN"][r][c]. Built once at import so the
+    evaluation and the GUI eval bar just look values up.
+    """
+    table = {}
+    for color, sign in (("w", 1), ("b", -1)):
+        for piece, base in pieceScore.items():
+            sq = color + piece
+            rows = []
+            for r in range(8):
+                row = []
+                for c in range(8):
+                    pst = 0
+                    if piece != "K":
+                        pst = get_pst_value(sq, r, c) * 0.01
+                    row.append(sign * (base + pst))
+                rows.append(row)
+            table[sq] = rows
+    return table
+
+squareScores = build_square_scores()
+
+def material_pst_score(board):
+    """Material + PST of a whole board, positive is good for white"""
+    score = 0.0
+    for r in range(8):
+        row = board[r]
+        for c in range(8):
+            sq = row[c]
+            if sq != "--":
+                score += squareScores[sq][r][c]
+    return score
+
+def material_pst_delta(move):
+    """
+    How much material_pst_score changes when move is made, so callers can
+    keep a running score instead of rescanning the board after every move.
+    Subtract it again when the move is undone.
+    """
+    moved = move.pieceMoved
+    delta = -squareScores[moved][move.startRow][move.startCol]
+    if move.isEnpassantMove:
+        delta -= squareScores[move.pieceCaptured][move.startRow][move.endCol]
+    elif move.pieceCaptured != "--":
+        delta -= squareScores[move.pieceCaptured][move.endRow][move.endCol]
+    landed = moved[0] + "Q" if move.isPawnPromotion else moved
+    delta += squareScores[landed][move.endRow][move.endCol]
+    if move.isCastleMove:
+        rook = moved[0] + "R"
+        if move.endCol - move.startCol == 2:  # king side
+            rookFrom, rookTo = move.endCol + 1, move.endCol - 1
+        else:  # queen side
+            rookFrom, rookTo = move.endCol - 2, move.endCol + 1
+        delta += squareScores[rook][move.endRow][rookTo] - squareScores[rook][move.endRow][rookFrom]
+    return delta
+
 def find_king_positions_from_board(board):
     """
     Return (white_king_pos, black_king_pos) as ( (wr,wc), (br,bc) )
@@ -210,23 +623,25 @@ def find_king_positions_from_board(board):
     return wk, bk
 
 def get_all_attacks(gs, white_to_move):
-    """Cached attack generation"""
-    cache_key = f"attacks_{white_to_move}_{id(gs.board)}"
-    if hasattr(gs, '_attack_cache') and cache_key in gs._attack_cache:
-        return gs._attack_cache[cache_key]
-    
+    """
+    Squares the side attacks, cached by position. Pinned pieces still
+    attack, so the pseudo legal moves are enough (and a lot cheaper than
+    getValidMoves, which makes and takes back every move).
+    """
+    cache_key = (gs.zobristKey, white_to_move)
+    attacks = attack_cache.get(cache_key)
+    if attacks is not None:
+        return attacks
+
     original = gs.whiteToMove
     gs.whiteToMove = white_to_move
     try:
-        moves = gs.getValidMoves()
+        moves = gs.getAllPossibleMoves()
         attacks = set((m.endRow, m.endCol) for m in moves)
     finally:
         gs.whiteToMove = original
-    
-    # Cache the result
-    if not hasattr(gs, '_attack_cache'):
-        gs._attack_cache = {}
-    gs._attack_cache[cache_key] = attacks
+
+    attack_cache.put(cache_key, attacks)
     return attacks
 
 def is_square_attacked(gs, row, col, by_white):
@@ -301,98 +716,71 @@ def has_queen_moved(board, is_white):
     else:
         return board[0][3] != "bQ"
 
-def opening_phase_score(gs):
+def opening_terms(gs):
     """
-    Evaluate opening principles:
-    - Penalize early queen moves (especially before development/castling)
-    - Reward minor piece development
-    - Reward castling
-    - Reward center control with pawns
+    The opening principles as counts, white minus black, keyed like
+    evalWeights (empty once the opening is over):
+    - early queen moves (before development / castling)
+    - minor piece development
+    - castling
+    - center pawns
     """
     board = gs.board
-    score = 0.0
-    
+    terms = {}
+
     # Only apply opening principles in early game
     if not is_opening_phase(gs):
-        return score
-    
-    # Count developed pieces for both sides
-    white_developed = count_developed_pieces(board, True)
-    black_developed = count_developed_pieces(board, False)
-    
-    # Reward development (0.5 per developed piece - increased)
-    score += white_developed * 0.5
-    score -= black_developed * 0.5
-    
-    # Check center pawn moves (good opening principle)
-    white_center_moved = is_center_pawn_moved(board, True)
-    black_center_moved = is_center_pawn_moved(board, False)
-    
-    if white_center_moved:
-        score += 0.3
-    if black_center_moved:
-        score -= 0.3
-    
-    # Check if queens have moved
-    white_queen_moved = has_queen_moved(board, True)
-    black_queen_moved = has_queen_moved(board, False)
+        return terms
+
+    for is_white, sign in ((True, 1), (False, -1)):
+        developed = count_developed_pieces(board, is_white)
+        center_moved = is_center_pawn_moved(board, is_white)
+        queen_moved = has_queen_moved(board, is_white)
+        castled = has_castled(board, is_white)
+
+        terms["development"] = terms.get("development", 0) + sign * developed
+        if center_moved:
+            terms["center_pawn"] = terms.get("center_pawn", 0) + sign
+
+        # early queen moves, the less developed the worse
+        if queen_moved:
+            if developed == 0:
+                name = "early_queen_undeveloped"
+            elif developed == 1:
+                name = "early_queen_one_developed"
+            elif developed < 3:
+                name = "early_queen_under_three"
+            elif not center_moved:
+                name = "early_queen_center_closed"
+            else:
+                name = None
+            if name is not None:
+                terms[name] = terms.get(name, 0) + sign
+            if not castled:
+                terms["queen_before_castling"] = terms.get("queen_before_castling", 0) + sign
+
+        if castled:
+            terms["castled"] = terms.get("castled", 0) + sign
+            if developed >= 2:
+                # castling after developing
+                terms["castled_developed"] = terms.get("castled_developed", 0) + sign
+        # developed but hasn't castled yet: encourage it
+        elif developed >= 2 and not queen_moved:
+            terms["castle_ready"] = terms.get("castle_ready", 0) + sign
+
+    return terms
 
-    # Check castling status
-    white_castled = has_castled(board, True)
-    black_castled = has_castled(board, False)
-    
-    # STRONGER penalties for early queen moves
-    if black_queen_moved:
-        if black_developed == 0:
-            score += 2.5
-        elif black_developed == 1:
-            score += 2.0
-        elif black_developed < 3:
-            score += 1.5
-        elif not black_center_moved:
-            score += 1.0
-        # NEW: Penalty for moving queen before castling
-        if not black_castled:
-            score += 0.8
-    
-    if white_queen_moved:
-        if white_developed == 0:
-            score -= 2.5
-        elif white_developed == 1:
-            score -= 2.0
-        elif white_developed < 3:
-            score -= 1.5
-        elif not white_center_moved:
-            score -= 1.0
-        # NEW: Penalty for moving queen before castling
-        if not white_castled:
-            score -= 0.8
-    
-    # Reward castling (Increased reward)
-    if black_castled:
-        score -= 1.5
-        if black_developed >= 2:
-            score -= 0.6 # Extra bonus for castling after developing
-    
-    if white_castled:
-        score += 1.5
-        if white_developed >= 2:
-            score += 0.6 # Extra bonus for castling after developing
-    
-    # Encourage castling if developed but haven't castled yet
-    if black_developed >= 2 and not black_castled and not black_queen_moved:
-        score -= 0.5
-    
-    if white_developed >= 2 and not white_castled and not white_queen_moved:
-        score += 0.5
-    
+def opening_phase_score(gs):
+    """Evaluate opening principles, see opening_terms"""
+    score = 0.0
+    for name, count in opening_terms(gs).items():
+        score += evalWeights[name] * count
     return score
 
 # ---------- Evaluation components ----------
 
 def bishop_pair_bonus(board):
     """Adds a bonus for the bishop pair"""
-    score = 0.0
     white_bishops = 0
     black_bishops = 0
     for r in range(8):
@@ -402,70 +790,71 @@ def bishop_pair_bonus(board):
                 white_bishops += 1
             elif sq == "bB":
                 black_bishops += 1
-    
-    # Give a 0.5 advantage for holding the pair
-    if white_bishops >= 2:
-        score += 0.5
-    if black_bishops >= 2:
-        score -= 0.5
-        
-    return score
 
-def rooks_on_files_score(board):
+    # holding the pair, white minus black
+    pairs = (white_bishops >= 2) - (black_bishops >= 2)
+    return evalWeights["bishop_pair"] * pairs
+
+def rook_file_terms(board, pawns=None):
     """
-    Rewards rooks on open or semi-open files.
+    (semi-open, open) rook counts, white minus black. An open file counts
+    as both, its bonus comes on top of the semi-open one.
+    pawns is the PawnEntry of the position, if the caller already has it.
     """
-    score = 0.0
-    
+    semi_open = 0
+    fully_open = 0
+
     # First, get a count of pawns on each file
-    white_pawns_on_file = [0] * 8
-    black_pawns_on_file = [0] * 8
-    for r in range(8):
-        for c in range(8):
-            sq = board[r][c]
-            if sq == "wp":
-                white_pawns_on_file[c] += 1
-            elif sq == "bp":
-                black_pawns_on_file[c] += 1
-    
-    # Now, check for rooks and apply bonuses
+    if pawns is None:
+        pawns = PawnEntry(board)
+    white_pawns_on_file = pawns.white_files
+    black_pawns_on_file = pawns.black_files
+
     for r in range(8):
         for c in range(8):
             sq = board[r][c]
             if sq == "wR":
                 if white_pawns_on_file[c] == 0:
                     # File is semi-open for white
-                    score += 0.25
+                    semi_open += 1
                     if black_pawns_on_file[c] == 0:
                         # File is fully open
-                        score += 0.35 # Additional bonus
+                        fully_open += 1
             elif sq == "bR":
                 if black_pawns_on_file[c] == 0:
                     # File is semi-open for black
-                    score -= 0.25
+                    semi_open -= 1
                     if white_pawns_on_file[c] == 0:
                         # File is fully open
-                        score -= 0.35 # Additional bonus
-    return score
+                        fully_open -= 1
+    return semi_open, fully_open
 
-def pawn_shield_bonus(gs, wk, bk):
-    board = gs.board
+def rooks_on_files_score(board, pawns=None):
+    """Rewards rooks on open or semi-open files"""
+    semi_open, fully_open = rook_file_terms(board, pawns)
+    return evalWeights["rook_semi_open"] * semi_open + evalWeights["rook_open"] * fully_open
+
+def pawn_shield_bonus(gs, wk, bk, pawns=None):
+    if pawns is None:
+        pawns = PawnEntry(gs.board)
     score = 0.0
     if wk:
         wk_r, wk_c = wk
-        for dr, dc in [(1, -1), (1, 0), (1, 1)]:
-            r, c = wk_r + dr, wk_c + dc
-            if 0 <= r < 8 and 0 <= c < 8 and board[r][c] == "wp":
-                score += 0.15
+        r = wk_r + 1
+        if r < 8:
+            for c in (wk_c - 1, wk_c, wk_c + 1):
+                if 0 <= c < 8 and pawns.white_rows[c] >> r & 1:
+                    score += 0.15
     if bk:
         bk_r, bk_c = bk
-        for dr, dc in [(-1, -1), (-1, 0), (-1, 1)]:
-            r, c = bk_r + dr, bk_c + dc
-            if 0 <= r < 8 and 0 <= c < 8 and board[r][c] == "bp":
-                score -= 0.15
+        r = bk_r - 1
+        if r >= 0:
+            for c in (bk_c - 1, bk_c, bk_c + 1):
+                if 0 <= c < 8 and pawns.black_rows[c] >> r & 1:
+                    score -= 0.15
     return score
 
-def king_safety(gs, wk, bk):
+def king_safety(gs, wk, bk, pawns=None):
     score = 0.0
     board = gs.board
     black_attacks = get_all_attacks(gs, False)
@@ -493,70 +882,94 @@ def king_safety(gs, wk, bk):
             if s in white_attacks:
                 score += 0.25
 
-    score += pawn_shield_bonus(gs, wk, bk)
+    score += pawn_shield_bonus(gs, wk, bk, pawns)
     return score
 
-def pawn_structure(gs):
-    board = gs.board
-    score = 0.0
-    white_files = [0] * 8
-    black_files = [0] * 8
-
-    for r in range(8):
-        for c in range(8):
-            if board[r][c] == "wp":
-                white_files[c] += 1
-            elif board[r][c] == "bp":
-                black_files[c] += 1
-
-    for f in range(8):
-        if white_files[f] > 1:
-            score -= 0.20 * (white_files[f] - 1)
-        if black_files[f] > 1:
-            score += 0.20 * (black_files[f] - 1)
-
-    for f in range(8):
-        if white_files[f] > 0:
-            if (f == 0 or white_files[f - 1] == 0) and (f == 7 or white_files[f + 1] == 0):
-                score -= 0.30
-        if black_files[f] > 0:
-            if (f == 0 or black_files[f - 1] == 0) and (f == 7 or black_files[f + 1] == 0):
-                score += 0.30
-
-    # Passed pawns - only check relevant files to save time
-    for c in range(8):
-        if white_files[c] > 0:
-            for r in range(7, -1, -1):
+class PawnEntry:
+    """
+    Everything the evaluation wants to know about the pawns alone: the
+    doubled / isolated / passed pawn score, pawn counts per file (rooks on
+    open files) and a bitmask of pawn rows per file (king pawn shield).
+    """
+    def __init__(self, board):
+        self.white_files = [0] * 8
+        self.black_files = [0] * 8
+        self.white_rows = [0] * 8  # bit r set: white pawn on (r, file)
+        self.black_rows = [0] * 8
+        for r in range(8):
+            for c in range(8):
                 if board[r][c] == "wp":
-                    is_passed = True
-                    # Quick check for blocking pawns
-                    for rr in range(r + 1, 8):
-                        for fc in (max(0, c-1), c, min(7, c+1)):
-                            if board[rr][fc] == "bp":
-                                is_passed = False
+                    self.white_files[c] += 1
+                    self.white_rows[c] |= 1 << r
+                elif board[r][c] == "bp":
+                    self.black_files[c] += 1
+                    self.black_rows[c] |= 1 << r
+        self.score = self.structure_score(board)
+
+    def structure_score(self, board):
+        score = 0.0
+        white_files = self.white_files
+        black_files = self.black_files
+
+        for f in range(8):
+            if white_files[f] > 1:
+                score -= 0.20 * (white_files[f] - 1)
+            if black_files[f] > 1:
+                score += 0.20 * (black_files[f] - 1)
+
+        for f in range(8):
+            if white_files[f] > 0:
+                if (f == 0 or white_files[f - 1] == 0) and (f == 7 or white_files[f + 1] == 0):
+                    score -= 0.30
+            if black_files[f] > 0:
+                if (f == 0 or black_files[f - 1] == 0) and (f == 7 or black_files[f + 1] == 0):
+                    score += 0.30
+
+        # Passed pawns - only check relevant files to save time
+        for c in range(8):
+            if white_files[c] > 0:
+                for r in range(7, -1, -1):
+                    if board[r][c] == "wp":
+                        is_passed = True
+                        # Quick check for blocking pawns
+                        for rr in range(r + 1, 8):
+                            for fc in (max(0, c-1), c, min(7, c+1)):
+                                if board[rr][fc] == "bp":
+                                    is_passed = False
+                                    break
+                            if not is_passed:
                                 break
-                        if not is_passed:
-                            break
-                    if is_passed:
-                        score += 0.25 + (7 - r) * 0.03
-                    break
-        
-        if black_files[c] > 0:
-            for r in range(8):
-                if board[r][c] == "bp":
-                    is_passed = True
-                    for rr in range(0, r):
-                        for fc in (max(0, c-1), c, min(7, c+1)):
-                            if board[rr][fc] == "wp":
-                                is_passed = False
+                        if is_passed:
+                            score += 0.25 + (7 - r) * 0.03
+                        break
+            
+            if black_files[c] > 0:
+                for r in range(8):
+                    if board[r][c] == "bp":
+                        is_passed = True
+                        for rr in range(0, r):
+                            for fc in (max(0, c-1), c, min(7, c+1)):
+                                if board[rr][fc] == "wp":
+                                    is_passed = False
+                                    break
+                            if not is_passed:
                                 break
-                        if not is_passed:
-                            break
-                    if is_passed:
-                        score -= 0.25 + r * 0.03
-                    break
+                        if is_passed:
+                            score -= 0.25 + r * 0.03
+                        break
 
-    return score
+        return score
+
+def pawn_entry(gs):
+    """The PawnEntry of gs, from the pawn hash table when possible"""
+    entry = pawn_table.get(gs.pawnKey)
+    if entry is None:
+        entry = PawnEntry(gs.board)
+        pawn_table.put(gs.pawnKey, entry)
+    return entry
+
+def pawn_structure(gs):
+    return pawn_entry(gs).score
 
 def mobility_score(gs):
     # Use cached attack sets for faster calculation
@@ -564,14 +977,15 @@ def mobility_score(gs):
     black_attacks = get_all_attacks(gs, False)
     return (len(white_attacks) - len(black_attacks)) * 0.08
 
-def tactical_score(gs):
+def tactical_score(gs, moves=None):
     score = 0.0
     original = gs.whiteToMove
-    moves = gs.getValidMoves()
+    if moves is None:
+        moves = gs.getValidMoves()
     
-    # Quick capture evaluation
+    # Quick capture evaluation, captures that lose the exchange don't count
     for m in moves:
-        if m.pieceCaptured != "--":
+        if m.pieceCaptured != "--" and see(gs, m) >= 0:
             captured_value = pieceScore.get(m.pieceCaptured[1], 0)
             if original:
                 score += 0.25 * captured_value
@@ -607,15 +1021,48 @@ def is_in_check(gs, checking_black):
     attacks = get_all_attacks(gs, not checking_black)
     return king_pos in attacks
 
+def has_legal_move(gs):
+    """Whether the side to move has a legal move, stopping at the first one found"""
+    enpassant, castleRights = gs.enpassantPossible, gs.currentCastlingRights
+    checkmate, stalemate = gs.checkmate, gs.stalemate
+    found = False
+    # castling is never the only legal move: the king can step onto the rook side
+    for move in gs.getAllPossibleMoves():
+        gs.makeMove(move)
+        found = not gs.movedIntoCheck()
+        gs.undoMove()
+        if found:
+            break
+    gs.enpassantPossible, gs.currentCastlingRights = enpassant, castleRights
+    gs.checkmate, gs.stalemate = checkmate, stalemate
+    return found
+
 # ---------- Main evaluation function ----------
-def scoreBoard(gs):
+def scoreBoard(gs, alpha=None, beta=None):
+    """
+    Evaluate gs, positive is good for white.
+    Given the search window (alpha, beta), the cheap terms are summed first
+    and if they are already further than LAZY_EVAL_MARGIN outside the
+    window, the costly attack based terms are skipped (lazy evaluation) and
+    a bound that is still outside the window is returned.
+    """
     if gs.checkmate:
         return -CHECKMATE if gs.whiteToMove else CHECKMATE
     if gs.stalemate:
         return STALEMATE
 
+    # a neural network evaluates this game instead (NeuralEvaluator.attach);
+    # the search doesn't generate the moves of its leaves, so mate and
+    # stalemate are told apart from ordinary positions here first
+    if gs.accumulator is not None:
+        if not has_legal_move(gs):
+            if gs.inCheck():
+                return -CHECKMATE if gs.whiteToMove else CHECKMATE
+            return STALEMATE
+        return max(-CHECKMATE, min(CHECKMATE, gs.accumulator.evaluate(gs)))
+
     # Try cache first
-    cache_key = eval_cache.get_key(gs.board, gs.whiteToMove)
+    cache_key = gs.zobristKey
     cached = eval_cache.get(cache_key)
     if cached is not None:
         return cached
@@ -625,38 +1072,56 @@ def scoreBoard(gs):
 
     # find kings from board
     wk, bk = find_king_positions_from_board(board)
+    pawns = pawn_entry(gs)
+
+    # ----- cheap terms: table lookups and board scans -----
 
     # MATERIAL + PST
-    for r in range(8):
-        for c in range(8):
-            sq = board[r][c]
-            if sq == "--":
-                continue
-            color = sq[0]
-            piece = sq[1]
-            base = pieceScore.get(piece, 0)
-            pst = 0
-            if piece != "K":
-                pst = get_pst_value(sq, r, c) * 0.01
-            if color == "w":
-                score += base + pst
-            else:
-                score -= base + pst
+    score += material_pst_score(board)
 
     # NEW PARAMETER: BISHOP PAIR
     score += bishop_pair_bonus(board)
 
     # NEW PARAMETER: ROOKS ON FILES
-    score += rooks_on_files_score(board)
+    score += rooks_on_files_score(board, pawns)
 
     # OPENING PRINCIPLES (only in opening)
     score += opening_phase_score(gs)
 
+    # PAWN STRUCTURE
+    score += pawns.score
+
+    # LAZY EXIT: the rest can't bring the score back inside the window.
+    # Only once the position is known not to be over: checkmate needs a
+    # check, stalemate is no check and no legal move, so a position out of
+    # check with a legal move is neither.
+    lazy_eval_stats["evaluations"] += 1
+    if LAZY_EVAL_MARGIN > 0:
+        if beta is not None and score - LAZY_EVAL_MARGIN >= beta:
+            lazy = score - LAZY_EVAL_MARGIN
+        elif alpha is not None and score + LAZY_EVAL_MARGIN <= alpha:
+            lazy = score + LAZY_EVAL_MARGIN
+        else:
+            lazy = None
+        if lazy is not None and not gs.inCheck() and has_legal_move(gs):
+            lazy_eval_stats["lazy_exits"] += 1
+            return lazy
+
+    # ----- costly terms: move generation and attack sets -----
+
+    # the search no longer generates the move list of its leaves, so this
+    # is where checkmate / stalemate get noticed (tactical_score reuses it)
+    validMoves = gs.getValidMoves()
+    if gs.checkmate or gs.stalemate:
+        score = STALEMATE if gs.stalemate else (-CHECKMATE if gs.whiteToMove else CHECKMATE)
+        eval_cache.put(cache_key, score)
+        return score
+
     # MOBILITY
     score += mobility_score(gs)
 
     # KING SAFETY
-    score += king_safety(gs, wk, bk)
+    score += king_safety(gs, wk, bk, pawns)
 
     # CHECKS
     if is_in_check(gs, True):
@@ -664,44 +1129,81 @@ def scoreBoard(gs):
     if is_in_check(gs, False):
         score += 0.6
 
-    # PAWN STRUCTURE
-    score += pawn_structure(gs)
-
     # TACTICAL
-    score += tactical_score(gs)
+    score += tactical_score(gs, validMoves)
 
     if score > CHECKMATE:
         score = CHECKMATE
     if score < -CHECKMATE:
         score = -CHECKMATE
 
-    # Cache the result
+    # Cache the result (lazy results are bounds, they never get here)
     eval_cache.put(cache_key, score)
     return score
 
 # ---------- Optimized Minimax with alpha-beta ----------
+class SearchStopped(Exception):
+    """Raised inside the search once the caller has asked it to stop"""
+
+
+class SearchInfo:
+    """
+    Per-search state: node count, best root move and principal variation.
+    Keeping this off the module globals lets several searches run side by
+    side (e.g. the async analysis service) without trampling each other.
+    """
+
+    def __init__(self, stopEvent=None):
+        self.nodes = 0
+        self.depth = 0
+        # aspiration window statistics, to tune the window against nodes
+        self.aspirationResearches = 0
+        self.failLows = 0
+        self.failHighs = 0
+        self.bestMove = None
+        self.bestScore = 0
+        self.pv = []
+        # multi-PV: ranked (move, score, pv) of the last completed depth
+        self.lines = []
+        # the root search leaves some legal moves out (multi-PV)
+        self.excludedRoot = False
+        # anything with an is_set() method: threading.Event, multiprocessing.Event
+        self.stopEvent = stopEvent
+
+    def checkStop(self):
+        if self.stopEvent is not None and self.stopEvent.is_set():
+            raise SearchStopped()
+
+
 def findRandomMoves(validMoves):
     return validMoves[random.randint(0, len(validMoves) - 1)]
 
-def findBestMoveMinMax(gs, validMoves, returnQueue=None):
+def findBestMoveMinMax(gs, validMoves, returnQueue=None, info=None):
     """
     Wrapped search with exception handling and time management
+    Pass a SearchInfo as info to get the score, PV and node count back
+    or to stop the search from outside.
     """
     global nextMove
     nextMove = None
     
-    # Clear cache for new search
-    if hasattr(gs, '_attack_cache'):
-        gs._attack_cache.clear()
+    if info is None:
+        info = SearchInfo()
     
     try:
         # If very few moves, just pick one quickly
         if len(validMoves) <= 3:
             result = validMoves[0]
         else:
-            _ = findMoveMinMaxAlphaBeta(gs, validMoves, MAX_DEPTH, -CHECKMATE, CHECKMATE, gs.whiteToMove)
+            # the shallow iterations fill the transposition table with the
+            # best moves that order the deeper ones
+            stored_search(gs, validMoves, MAX_DEPTH, info)
+            nextMove = info.bestMove
             result = nextMove if nextMove else validMoves[0]
     except Exception:
+        # imported here, it is only needed when something went wrong
+        import traceback
+
         traceback.print_exc()
         result = validMoves[0] if validMoves else None
     
@@ -713,53 +1215,261 @@ def findBestMoveMinMax(gs, validMoves, returnQueue=None):
     else:
         return result
 
-def findMoveMinMaxAlphaBeta(gs, validMoves, depth, alpha, beta, whiteToMove):
-    global nextMove
+def searchIterative(gs, validMoves, maxDepth=MAX_DEPTH, info=None, onDepth=None, multiPV=1):
+    """
+    Iterative deepening driver: searches depth 1, 2, ... maxDepth and calls
+    onDepth(info) after every completed iteration, so callers can stream
+    depth / score / PV / nodes while the search is still running.
+    With multiPV > 1 every iteration also finds the next best root moves
+    (each line excludes the moves of the lines before it, sharing the
+    transposition table); info.lines holds the ranked (move, score, pv).
+    If info.stopEvent gets set, the search unwinds, gs is restored and the
+    result of the last completed depth is kept.
+    """
+    if info is None:
+        info = SearchInfo()
+    baseLength = len(gs.moveLog)
+
+    for depth in range(1, maxDepth + 1):
+        lines = []
+        excluded = set()
+        try:
+            for k in range(min(multiPV, len(validMoves))):
+                rootMoves = [m for m in validMoves if m.moveID not in excluded]
+                previousScore = info.lines[k][1] if k < len(info.lines) else None
+                score, move, pvLine = aspirationSearch(gs, rootMoves, depth, previousScore, info, k > 0)
+                if move is None:
+                    break
+                if len(pvLine) < depth:
+                    pvLine = complete_pv(gs, pvLine, depth)
+                lines.append((move, score, pvLine))
+                excluded.add(move.moveID)
+        except SearchStopped:
+            # the search was cut in the middle of a line, take those moves back
+            while len(gs.moveLog) > baseLength:
+                gs.undoMove()
+            break
+        if not lines:
+            break
+        # best for the side to move first
+        lines.sort(key=lambda line: -line[1] if gs.whiteToMove else line[1])
+        info.lines = lines
+        info.depth = depth
+        info.bestMove, info.bestScore, info.pv = lines[0]
+        if onDepth is not None:
+            onDepth(info)
+    return info
+
+def stored_search(gs, validMoves, depth=MAX_DEPTH, info=None):
+    """
+    searchIterative, answered from analysis_store instead when it already
+    has gs searched to depth or deeper. Results deeper than the stored ones
+    are written back. The store holds handcrafted evaluation results only,
+    it is not used while a network is attached.
+    """
+    if info is None:
+        info = SearchInfo()
+    store = analysis_store if gs.accumulator is None else None
+    if store is not None:
+        entry = store.get(gs.zobristKey)
+        if entry is not None and entry[0] >= depth:
+            pv = moves_from_ids(gs, validMoves, entry[3])
+            if pv:
+                info.depth = entry[0]
+                info.bestMove, info.bestScore, info.pv = pv[0], entry[1], pv
+                info.lines = [(pv[0], entry[1], pv)]
+                return info
+    searchIterative(gs, validMoves, depth, info)
+    if store is not None and info.bestMove is not None:
+        store.put(
+            gs.zobristKey, info.depth, info.bestScore, info.bestMove.moveID, [m.moveID for m in info.pv]
+        )
+    return info
+
+def moves_from_ids(gs, validMoves, moveIDs):
+    """
+    A stored line of moveIDs as Move objects, as far as the moves are legal
+    (the first one taken from validMoves)
+    """
+    line = []
+    moves = validMoves
+    for moveID in moveIDs:
+        move = next((m for m in moves if m.moveID == moveID), None)
+        if move is None:
+            break
+        line.append(move)
+        gs.makeMove(move)
+        moves = gs.getValidMoves()
+    for move in line:
+        gs.undoMove()
+    return line
+
+def aspirationSearch(gs, rootMoves, depth, previousScore, info, excludedRoot=False):
+    """
+    One root search at depth, in an aspiration window around previousScore
+    (the full window when there is none). Returns (score, best move, pv).
+    excludedRoot says some legal root moves were left out (multi-PV), so
+    the root result must not go into the transposition table.
+    """
+    if previousScore is not None and ASPIRATION_WINDOW > 0:
+        delta = ASPIRATION_WINDOW
+        alpha = max(previousScore - delta, -CHECKMATE)
+        beta = min(previousScore + delta, CHECKMATE)
+    else:
+        alpha, beta = -CHECKMATE, CHECKMATE
+    researches = 0
+    while True:
+        iteration = SearchInfo(info.stopEvent)
+        iteration.depth = depth
+        iteration.nodes = info.nodes
+        iteration.excludedRoot = excludedRoot
+        pvLine = []
+        try:
+            score = findMoveMinMaxAlphaBeta(
+                gs, rootMoves, depth, alpha, beta, gs.whiteToMove, iteration, 0, pvLine
+            )
+        finally:
+            info.nodes = iteration.nodes
+        if score <= alpha and alpha > -CHECKMATE:
+            info.failLows += 1
+            failedLow = True
+        elif score >= beta and beta < CHECKMATE:
+            info.failHighs += 1
+            failedLow = False
+        else:
+            return score, iteration.bestMove, pvLine
+        # outside the window the score is only a bound, search again
+        researches += 1
+        info.aspirationResearches += 1
+        delta *= ASPIRATION_GROWTH
+        if researches >= ASPIRATION_MAX_RESEARCHES:
+            alpha, beta = -CHECKMATE, CHECKMATE
+        elif failedLow:
+            alpha = max(score - delta, -CHECKMATE)
+        else:
+            beta = min(score + delta, CHECKMATE)
+
+def complete_pv(gs, pv, length):
+    """
+    A line cut short by a transposition table hit is continued with the
+    table's best moves, so callers (analysis, pondering) see the full PV.
+    """
+    pv = list(pv)
+    for move in pv:
+        gs.makeMove(move)
+    while len(pv) < length:
+        move = transposition_table.bestMove(gs, gs.getValidMoves())
+        if move is None:
+            break
+        gs.makeMove(move)
+        pv.append(move)
+    for move in pv:
+        gs.undoMove()
+    return pv
+
+def findBestMovesMultiPV(gs, validMoves, count, depth=MAX_DEPTH, info=None):
+    """
+    The count best moves of gs as a ranked list of (move, score, pv),
+    found in one iterative search instead of count separate ones.
+    """
+    if info is None:
+        info = SearchInfo()
+    searchIterative(gs, validMoves, depth, info, None, count)
+    return info.lines
+
+def findMoveMinMaxAlphaBeta(gs, validMoves, depth, alpha, beta, whiteToMove, info=None, ply=0, pvLine=None):
+    if info is None:
+        info = SearchInfo()
+    info.nodes += 1
+    info.checkStop()
+    if profiler is not None:
+        profiler.node(ply)
     
     # Quick terminal node check
     if depth == 0 or gs.checkmate or gs.stalemate:
-        return scoreBoard(gs)
-
-    # Sort moves once at the beginning for better pruning
-    if depth == MAX_DEPTH or depth == MAX_DEPTH - 1:
-        moves = sorted(validMoves, key=lambda m: get_move_priority(m, gs, whiteToMove), reverse=True)
+        return scoreBoard(gs, alpha, beta)
+
+    # Transposition table: reuse a result of the same position searched at
+    # least as deep, otherwise at least try its best move first
+    key = gs.zobristKey
+    hashMoveID = None
+    entry = transposition_table.get(key)
+    if entry is not None:
+        ttDepth, ttScore, ttBound, hashMoveID = entry
+        if ply > 0 and ttDepth >= depth:
+            if ttBound == EXACT:
+                return ttScore
+            if ttBound == LOWERBOUND and ttScore >= beta:
+                return ttScore
+            if ttBound == UPPERBOUND and ttScore <= alpha:
+                return ttScore
+    alphaOrig, betaOrig = alpha, beta
+
+    if validMoves is not None:
+        # the caller handed us the legal moves (the root)
+        if ply <= 1:
+            moves = sorted(validMoves, key=lambda m: get_move_priority(m, gs, whiteToMove), reverse=True)
+        else:
+            moves = validMoves
+        if hashMoveID is not None:
+            for i in range(len(moves)):
+                if moves[i].moveID == hashMoveID:
+                    moves = [moves[i]] + moves[:i] + moves[i + 1:]
+                    break
+        checkLegality = False
     else:
-        moves = validMoves  
-
-    if whiteToMove:
-        maxScore = -math.inf
-        for move in moves:
-            gs.makeMove(move)
-            nextMoves = gs.getValidMoves()
-            score = findMoveMinMaxAlphaBeta(gs, nextMoves, depth - 1, alpha, beta, False)
+        moves = generate_staged_moves(gs, hashMoveID, ply)
+        checkLegality = True
+
+    childPv = [] if pvLine is not None else None
+    bestMove = None
+    bestScore = -math.inf if whiteToMove else math.inf
+    legalMoves = 0
+    for move in moves:
+        gs.makeMove(move)
+        if checkLegality and gs.movedIntoCheck():
             gs.undoMove()
-            
-            if score > maxScore:
-                maxScore = score
-                if depth == MAX_DEPTH:
-                    nextMove = move
-            
+            continue
+        legalMoves += 1
+        if childPv is not None:
+            childPv.clear()
+        # the child generates its own moves, and only if it gets that far
+        score = findMoveMinMaxAlphaBeta(gs, None, depth - 1, alpha, beta, not whiteToMove, info, ply + 1, childPv)
+        gs.undoMove()
+
+        if (score > bestScore) if whiteToMove else (score < bestScore):
+            bestScore = score
+            bestMove = move
+            if ply == 0:
+                info.bestMove = move
+            if pvLine is not None:
+                pvLine[:] = [move] + childPv
+
+        if whiteToMove:
             alpha = max(alpha, score)
-            if beta <= alpha:
-                break
-        return maxScore
-    else:
-        minScore = math.inf
-        for move in moves:
-            gs.makeMove(move)
-            nextMoves = gs.getValidMoves()
-            score = findMoveMinMaxAlphaBeta(gs, nextMoves, depth - 1, alpha, beta, True)
-            gs.undoMove()
-            
-            if score < minScore:
-                minScore = score
-                if depth == MAX_DEPTH:
-                    nextMove = move
-            
+        else:
             beta = min(beta, score)
-            if beta <= alpha:
-                break
-        return minScore
+        if beta <= alpha:
+            if profiler is not None:
+                profiler.cutoff(ply, legalMoves - 1)
+            break
+
+    if legalMoves == 0:
+        # no legal move at all: checkmate or stalemate
+        if gs.inCheck():
+            return -CHECKMATE if whiteToMove else CHECKMATE
+        return STALEMATE
+
+    if bestScore <= alphaOrig:
+        bound = UPPERBOUND
+    elif bestScore >= betaOrig:
+        bound = LOWERBOUND
+    else:
+        bound = EXACT
+    # a root searched without some of its moves is not the real position
+    if ply > 0 or not info.excludedRoot:
+        transposition_table.put(key, depth, bestScore, bound, bestMove.moveID if bestMove else None)
+    return bestScore
 
 if __name__ == "__main__":
     print("Optimized SmartMoveFinder loaded. MAX_DEPTH =", MAX_DEPTH)
\ No newline at end of file
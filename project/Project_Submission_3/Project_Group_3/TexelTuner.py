@@ -0,0 +1,338 @@
+"""
+Texel style tuning of the evaluation weights in SmartMoveFinder: pieceScore,
+the piece-square tables and evalWeights (bishop pair, rook files, opening
+principles).
+
+Those terms are linear in their weights, so every labeled position becomes
+a row of feature counts (white minus black) once, kept as an int8 matrix in
+a cache file next to the data. The win probability of a position is
+sigmoid(K * eval); K is fitted first, then all weights are optimized
+together (Adam) on the mean squared error against the game results, with
+the loss and its gradient computed as matrix products over the whole set.
+The pawn structure is part of the eval as a fixed offset; the attack based
+terms (mobility, king safety, tactics) are left out, which is why the
+positions should be quiet.
+
+Data: a text file with one position per line, FEN then the result
+("1-0", "0-1", "1/2-1/2", or 1 / 0.5 / 0 after a ; or | or in [...]), e.g.
+    rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1 ; 1/2-1/2
+    rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1 [0.5]
+(EPD lines with c9 "1-0"; work too), or PGN files whose games label all of
+their positions. Lines without a result are skipped.
+
+Usage:
+    python TexelTuner.py positions.epd -o tuned_eval.py
+    python TexelTuner.py --pgn games.pgn -o tuned_eval.py --iterations 500
+The output file holds pieceScore, the tables, piecePositionScores and
+evalWeights in the form SmartMoveFinder defines them, ready to paste.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+import ChessEngine
+import PGNPipeline
+import SmartMoveFinder
+
+# the material / PST / term layout of a feature row
+MATERIAL_PIECES = ("p", "N", "B", "R", "Q")  # the king is not counted
+PST_TABLES = ("p", "N", "B", "R", "Q")  # the eval gives the king no PST
+TERMS = tuple(SmartMoveFinder.evalWeights)
+FEATURE_NAMES = (
+    ["material:" + p for p in MATERIAL_PIECES]
+    + ["pst:%s:%d%d" % (p, r, c) for p in PST_TABLES for r in range(8) for c in range(8)]
+    + ["term:" + name for name in TERMS]
+)
+MATERIAL_OFFSET = 0
+PST_OFFSET = len(MATERIAL_PIECES)
+TERM_OFFSET = PST_OFFSET + 64 * len(PST_TABLES)
+termColumn = {name: TERM_OFFSET + i for i, name in enumerate(TERMS)}
+
+RESULT_VALUES = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}
+# the label at the end of a line: "1-0" / "0-1" / "1/2-1/2" after a space,
+# a number (1, 0.5, 0) only as c9 "...", [...] or after a ; or | separator;
+# a bare trailing digit is the fullmove number of an unlabeled FEN
+resultPattern = re.compile(
+    r'(?:(?:c9\s+"|\[|[;|]\s*"?)(?P<number>[01](?:\.\d+)?)'
+    r'|(?:c9\s+"|\[|[;|]\s*"?|\s)(?P<text>1-0|0-1|1/2-1/2))"?\]?;?\s*$'
+)
+# rows converted to float at a time, bounds the memory next to the int8 matrix
+CHUNK = 65536
+
+
+# ---------- features ----------
+
+
+def currentWeights():
+    """The weights SmartMoveFinder uses now, in feature order (pawns)"""
+    w = np.zeros(len(FEATURE_NAMES))
+    for i, piece in enumerate(MATERIAL_PIECES):
+        w[MATERIAL_OFFSET + i] = SmartMoveFinder.pieceScore[piece]
+    for t, piece in enumerate(PST_TABLES):
+        table = SmartMoveFinder.piecePositionScores["wp" if piece == "p" else piece]
+        for r in range(8):
+            for c in range(8):
+                w[PST_OFFSET + t * 64 + r * 8 + c] = table[r][c] * 0.01
+    for name, column in termColumn.items():
+        w[column] = SmartMoveFinder.evalWeights[name]
+    return w
+
+
+def positionFeatures(gs):
+    """(feature counts, fixed offset) of gs, eval = counts @ weights + offset"""
+    x = np.zeros(len(FEATURE_NAMES), dtype=np.int8)
+    board = gs.board
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            if piece == "--" or piece[1] == "K":
+                continue
+            kind = piece[1]
+            if piece[0] == "w":
+                sign, row = 1, r
+            else:
+                # black reads the table upside down, like get_pst_value
+                sign, row = -1, 7 - r
+            x[MATERIAL_OFFSET + MATERIAL_PIECES.index(kind)] += sign
+            x[PST_OFFSET + PST_TABLES.index(kind) * 64 + row * 8 + c] += sign
+    pawns = SmartMoveFinder.PawnEntry(board)
+    bishops = [row.count("wB") for row in board], [row.count("bB") for row in board]
+    x[termColumn["bishop_pair"]] = (sum(bishops[0]) >= 2) - (sum(bishops[1]) >= 2)
+    semi_open, fully_open = SmartMoveFinder.rook_file_terms(board, pawns)
+    x[termColumn["rook_semi_open"]] = semi_open
+    x[termColumn["rook_open"]] = fully_open
+    for name, count in SmartMoveFinder.opening_terms(gs).items():
+        x[termColumn[name]] = count
+    return x, pawns.score
+
+
+# ---------- data ----------
+
+
+def readPositions(path):
+    """(fen, result) of every labeled line of a positions file"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            match = resultPattern.search(line)
+            if not line or match is None:
+                continue
+            text = match.group("text")
+            result = RESULT_VALUES[text] if text is not None else float(match.group("number"))
+            fen = line[: match.start()].rstrip(' ;|"')
+            yield fen, result
+
+
+def pgnPositions(paths, skipPlies=8):
+    """
+    (gs, result) for the positions of decided games, skipping the opening
+    book plies and positions in check (not quiet). gs is reused: use it
+    before asking for the next one.
+    """
+    for game in PGNPipeline.readPGNFiles(paths):
+        if game.result not in RESULT_VALUES:
+            continue
+        result = RESULT_VALUES[game.result]
+        gs = ChessEngine.GameState()
+        for ply, san in enumerate(game.moves):
+            try:
+                gs.makeMove(gs.parseSAN(san))
+            except ValueError:
+                break
+            if ply + 1 >= skipPlies and not gs.inCheck():
+                yield gs, result
+
+
+def extractFeatures(samples):
+    """(X int8, offsets, results) for an iterable of (gs, result)"""
+    # one flat buffer instead of an array object per position
+    rows, offsets, results = bytearray(), [], []
+    for gs, result in samples:
+        x, offset = positionFeatures(gs)
+        rows += x.tobytes()
+        offsets.append(offset)
+        results.append(result)
+    if not results:
+        raise ValueError("no labeled positions found")
+    return (
+        np.frombuffer(rows, dtype=np.int8).reshape(len(results), len(FEATURE_NAMES)),
+        np.asarray(offsets, dtype=np.float32),
+        np.asarray(results, dtype=np.float32),
+    )
+
+
+def _fenSamples(path):
+    gs = ChessEngine.GameState()
+    for fen, result in readPositions(path):
+        gs.loadFEN(fen)
+        yield gs, result
+
+
+def loadDataset(sources, pgn=False, cachePath=None):
+    """
+    The feature matrix of the sources, from the cache file when it was made
+    from the same (unchanged) files with the same feature layout.
+    """
+    if cachePath is None:
+        cachePath = sources[0] + ".features.npz"
+    stamp = np.array([(os.path.getsize(p), os.path.getmtime(p)) for p in sources])
+    if os.path.exists(cachePath):
+        with np.load(cachePath) as cached:
+            if (
+                list(cached["names"]) == FEATURE_NAMES
+                and cached["stamp"].shape == stamp.shape
+                and np.array_equal(cached["stamp"], stamp)
+            ):
+                return cached["X"], cached["offsets"], cached["results"]
+    if pgn:
+        samples = pgnPositions(sources)
+    else:
+        samples = (sample for path in sources for sample in _fenSamples(path))
+    X, offsets, results = extractFeatures(samples)
+    np.savez(cachePath, X=X, offsets=offsets, results=results, names=np.array(FEATURE_NAMES), stamp=stamp)
+    return X, offsets, results
+
+
+# ---------- optimization ----------
+
+
+def evaluate(X, offsets, w):
+    """eval of every position (pawns, white positive), CHUNK rows at a time"""
+    out = np.empty(len(X), dtype=np.float64)
+    for i in range(0, len(X), CHUNK):
+        out[i : i + CHUNK] = X[i : i + CHUNK].astype(np.float32) @ w + offsets[i : i + CHUNK]
+    return out
+
+
+def sigmoid(v):
+    return 1.0 / (1.0 + np.exp(-v))
+
+
+def loss(X, offsets, results, w, K):
+    return float(np.mean((results - sigmoid(K * evaluate(X, offsets, w))) ** 2))
+
+
+def fitK(X, offsets, results, w, low=0.01, high=10.0, steps=40):
+    """The sigmoid scale that fits the current eval best (golden section on log K)"""
+    evals = evaluate(X, offsets, w)
+
+    def error(logK):
+        return np.mean((results - sigmoid(10**logK * evals)) ** 2)
+
+    a, b = np.log10(low), np.log10(high)
+    g = (np.sqrt(5) - 1) / 2
+    for _ in range(steps):
+        c, d = b - g * (b - a), a + g * (b - a)
+        if error(c) < error(d):
+            b = d
+        else:
+            a = c
+    return 10 ** ((a + b) / 2)
+
+
+def gradient(X, offsets, results, w, K):
+    """d loss / d w, one pass over the matrix"""
+    grad = np.zeros_like(w)
+    for i in range(0, len(X), CHUNK):
+        Xc = X[i : i + CHUNK].astype(np.float32)
+        s = sigmoid(K * (Xc @ w + offsets[i : i + CHUNK]))
+        g = 2.0 * (s - results[i : i + CHUNK]) * s * (1.0 - s) * K
+        grad += g @ Xc
+    return grad / len(X)
+
+
+def tune(X, offsets, results, w=None, K=None, iterations=300, rate=0.01, log=None):
+    """Adam on all weights at once, returns (weights, K)"""
+    if w is None:
+        w = currentWeights()
+    w = w.astype(np.float32)
+    if K is None:
+        K = fitK(X, offsets, results, w)
+    m = np.zeros_like(w)
+    v = np.zeros_like(w)
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    for t in range(1, iterations + 1):
+        g = gradient(X, offsets, results, w, K)
+        m = beta1 * m + (1 - beta1) * g
+        v = beta2 * v + (1 - beta2) * g * g
+        w -= rate * (m / (1 - beta1**t)) / (np.sqrt(v / (1 - beta2**t)) + eps)
+        if log is not None and (t % 50 == 0 or t == iterations):
+            log("iteration %d, loss %.6f" % (t, loss(X, offsets, results, w, K)))
+    return w, K
+
+
+# ---------- output ----------
+
+TABLE_NAMES = {"p": "pawnScores", "N": "knightScores", "B": "bishopScores", "R": "rookScores", "Q": "queenScores"}
+
+
+def _formatTable(name, rows):
+    lines = ["%s = [" % name]
+    for row in rows:
+        lines.append("    [" + ", ".join("%4d" % v for v in row) + "],")
+    lines.append("]")
+    return "\n".join(lines)
+
+
+def formatWeights(w):
+    """Python source of the tuned weights, laid out like SmartMoveFinder"""
+    material = {p: round(float(w[MATERIAL_OFFSET + i]), 2) for i, p in enumerate(MATERIAL_PIECES)}
+    parts = [
+        "pieceScore = {\"K\": 0, \"Q\": %s, \"R\": %s, \"B\": %s, \"N\": %s, \"p\": %s}"
+        % (material["Q"], material["R"], material["B"], material["N"], material["p"])
+    ]
+    for t, piece in enumerate(PST_TABLES):
+        block = w[PST_OFFSET + t * 64 : PST_OFFSET + (t + 1) * 64] * 100
+        parts.append(_formatTable(TABLE_NAMES[piece], np.rint(block).astype(int).reshape(8, 8).tolist()))
+    # the eval does not use a king PST, it is carried over unchanged
+    parts.append(_formatTable("kingScores", SmartMoveFinder.kingScores))
+    parts.append(
+        "piecePositionScores = {\n"
+        '    "N": knightScores,\n'
+        '    "B": bishopScores,\n'
+        '    "Q": queenScores,\n'
+        '    "R": rookScores,\n'
+        '    "K": kingScores,\n'
+        '    "wp": pawnScores,\n'
+        '    "bp": pawnScores,\n'
+        "}"
+    )
+    terms = ["evalWeights = {"]
+    for name, column in termColumn.items():
+        terms.append('    "%s": %s,' % (name, round(float(w[column]), 3)))
+    terms.append("}")
+    parts.append("\n".join(terms))
+    return "\n\n".join(parts) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Texel tuning of the SmartMoveFinder evaluation")
+    parser.add_argument("data", nargs="+", help="labeled positions file(s), or PGN files with --pgn")
+    parser.add_argument("--pgn", action="store_true", help="the data are PGN games labeled by their result")
+    parser.add_argument("-o", "--output", default="tuned_eval.py")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=0.01, help="Adam step size, pawns")
+    parser.add_argument("--cache", default=None, help="feature matrix cache, default: <data>.features.npz")
+    args = parser.parse_args(argv)
+
+    log = lambda text: print(text, file=sys.stderr)
+    startTime = time.perf_counter()
+    X, offsets, results = loadDataset(args.data, args.pgn, args.cache)
+    log("%d positions x %d features, %.1f s" % (X.shape[0], X.shape[1], time.perf_counter() - startTime))
+    w0 = currentWeights()
+    K = fitK(X, offsets, results, w0)
+    log("K = %.4f, loss of the current weights %.6f" % (K, loss(X, offsets, results, w0, K)))
+    startTime = time.perf_counter()
+    w, K = tune(X, offsets, results, w0, K, args.iterations, args.rate, log)
+    log("tuned in %.1f s" % (time.perf_counter() - startTime))
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(formatWeights(w))
+    log("written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()